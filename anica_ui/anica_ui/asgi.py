@@ -14,3 +14,6 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'anica_ui.settings')
 
 application = get_asgi_application()
+
+from basic_ui.models import start_actx_pool_warm_up
+start_actx_pool_warm_up()
@@ -129,3 +129,30 @@ STATIC_URL = '/static/'
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Caching of expensive computations (see basic_ui/caching.py)
+
+# Directory for persistent caches that survive restarts, set to None to only
+# cache in memory.
+ANICA_UI_CACHE_DIR = BASE_DIR / 'cache'
+
+# Maximal number of abstract instructions whose feasible schemes are kept in
+# memory per process.
+FEASIBLE_SCHEME_CACHE_SIZE = 100000
+
+# Maximal number of distinct abstraction configs whose differences to the
+# default config are kept in memory per process.
+CONFIG_DELTA_CACHE_SIZE = 10000
+
+# Maximal number of rendered abstract blocks whose HTML is kept in memory per
+# process.
+ABSBLOCK_HTML_CACHE_SIZE = 10000
+
+# Maximal number of AbstractionContexts that are kept per process, to be
+# shared between requests.
+ACTX_POOL_SIZE = 16
+
+# Create AbstractionContexts for the most recent configs in the background
+# when a server process starts, so that the first requests are fast as well.
+ACTX_POOL_WARM_UP = False
@@ -0,0 +1,457 @@
+""" Caches for results of expensive computations that are needed both when
+importing data and when rendering views.
+
+There are two layers: a bounded in-memory LRU cache per process and an
+optional persistent cache in an sqlite file in the ANICA_UI_CACHE_DIR
+directory (see settings.py), which survives restarts and is shared between
+processes.
+"""
+
+import atexit
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from functools import cached_property
+from hashlib import sha256
+import importlib.metadata
+import json
+import os
+from pathlib import Path
+import pickle
+import sqlite3
+import threading
+
+from django.conf import settings
+
+
+class LRUCache:
+    """ A thread-safe dictionary with a bounded number of entries that evicts
+    the least recently used ones.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = Counter()
+
+    def get(self, key, default=None):
+        with self.lock:
+            res = self.entries.get(key, None)
+            if res is None:
+                self.stats['misses'] += 1
+                return default
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return res
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class DiskCache:
+    """ A persistent key-value store in an sqlite file, with values that are
+    pickled. Keys are strings and grouped in namespaces.
+
+    Connections are opened lazily and per process, so that instances can be
+    inherited by worker processes.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.con = None
+        self.pid = None
+
+    def _get_con(self):
+        if self.con is None or self.pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.con = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            self.con.execute("PRAGMA journal_mode=WAL")
+            self.con.execute("CREATE TABLE IF NOT EXISTS entries (namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, PRIMARY KEY (namespace, key))")
+            self.con.commit()
+            self.pid = os.getpid()
+        return self.con
+
+    def get(self, namespace, key):
+        cur = self._get_con().execute("SELECT value FROM entries WHERE namespace=? AND key=?", (namespace, key))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        return pickle.loads(row[0])
+
+    def put(self, namespace, key, value):
+        con = self._get_con()
+        with con:
+            con.execute("INSERT OR REPLACE INTO entries (namespace, key, value) VALUES (?, ?, ?)",
+                    (namespace, key, pickle.dumps(value)))
+
+    def get_many(self, namespace, keys):
+        """ Get a dict with the entries for those of the keys that are
+        present.
+        """
+        con = self._get_con()
+        keys = list(keys)
+        res = dict()
+        # stay below sqlite's limit for the number of query parameters
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i+500]
+            placeholders = ",".join("?" * len(chunk))
+            cur = con.execute(f"SELECT key, value FROM entries WHERE namespace=? AND key IN ({placeholders})", (namespace, *chunk))
+            for k, v in cur:
+                res[k] = pickle.loads(v)
+        return res
+
+    def put_many(self, namespace, items):
+        con = self._get_con()
+        with con:
+            con.executemany("INSERT OR REPLACE INTO entries (namespace, key, value) VALUES (?, ?, ?)",
+                    ((namespace, k, pickle.dumps(v)) for k, v in items))
+
+    def clear(self, namespace):
+        con = self._get_con()
+        with con:
+            con.execute("DELETE FROM entries WHERE namespace=?", (namespace,))
+
+
+_disk_cache = None
+
+def get_disk_cache():
+    """ Get the process-wide DiskCache, or None if persistent caching is
+    disabled in the settings.
+    """
+    global _disk_cache
+    cache_dir = getattr(settings, 'ANICA_UI_CACHE_DIR', None)
+    if cache_dir is None:
+        return None
+    if _disk_cache is None:
+        _disk_cache = DiskCache(Path(cache_dir) / 'cache.sqlite3')
+    return _disk_cache
+
+
+def package_version(name):
+    """ The installed version of a python package, to invalidate cached
+    results when it changes.
+    """
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+def config_fingerprint(config_dict):
+    """ A hash that identifies the given (json-like) config dict by its
+    content.
+    """
+    canonical = json.dumps(config_dict, sort_keys=True, separators=(',', ':'))
+    return sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def actx_fingerprint(actx):
+    """ The config fingerprint of an AbstractionContext, computed once per
+    context.
+    """
+    res = getattr(actx, 'config_fingerprint', None)
+    if res is None:
+        config_dict = dict(actx.get_config())
+        config_dict['predmanager'] = None
+        res = config_fingerprint(config_dict)
+        actx.config_fingerprint = res
+    return res
+
+
+class FeasibleSchemeCache:
+    """ Memoizes `insn_feature_manager.compute_feasible_schemes` by the
+    canonical feature values of an abstract instruction and the fingerprint
+    of the abstraction config.
+
+    Only the string representations of the schemes are cached, they are
+    mapped back to the scheme objects of the requesting context.
+
+    New entries are buffered and written to the disk cache in a single
+    transaction by `flush`, which happens when the buffer is full, with
+    `pop_stats`, and when the process exits.
+    """
+    def __init__(self, maxsize, flush_size=4096):
+        self.lru = LRUCache(maxsize)
+        self.stats = Counter()
+        self.flush_size = flush_size
+        self.pending = dict()
+        self.pending_lock = threading.Lock()
+
+    @cached_property
+    def namespace(self):
+        # the schemes come from iwho, anica's feature manager decides which
+        # of them are feasible
+        return f"feasible_schemes:{package_version('anica')}:{package_version('iwho')}"
+
+    def get_strs(self, actx, features):
+        key = actx_fingerprint(actx) + ':' + json.dumps({k: v.to_json_dict() for k, v in features.items()}, sort_keys=True)
+
+        res = self.lru.get(key)
+        if res is not None:
+            self.stats['hits'] += 1
+            return res
+
+        disk_cache = get_disk_cache()
+        if disk_cache is not None:
+            with self.pending_lock:
+                res = self.pending.get(key, None)
+            if res is None:
+                res = disk_cache.get(self.namespace, key)
+            if res is not None:
+                self.stats['disk_hits'] += 1
+                self.lru.put(key, res)
+                return res
+
+        self.stats['misses'] += 1
+        res = tuple(map(str, actx.insn_feature_manager.compute_feasible_schemes(features)))
+        self.lru.put(key, res)
+        if disk_cache is not None:
+            with self.pending_lock:
+                self.pending[key] = res
+                num_pending = len(self.pending)
+            if num_pending >= self.flush_size:
+                self.flush()
+        return res
+
+    def flush(self):
+        """ Write the buffered new entries to the disk cache.
+        """
+        with self.pending_lock:
+            pending = self.pending
+            self.pending = dict()
+        if len(pending) == 0:
+            return
+        disk_cache = get_disk_cache()
+        if disk_cache is not None:
+            disk_cache.put_many(self.namespace, pending.items())
+
+    def get(self, actx, features):
+        str_to_scheme = actx.iwho_ctx.str_to_scheme
+        return [str_to_scheme[s] for s in self.get_strs(actx, features)]
+
+    def pop_stats(self):
+        """ Return the statistics collected since the last call and reset
+        them, e.g., to transfer them from a worker process. Buffered entries
+        are flushed to the disk cache.
+        """
+        self.flush()
+        res = self.stats
+        res['evictions'] += self.lru.stats['evictions']
+        self.stats = Counter()
+        self.lru.stats = Counter()
+        return res
+
+    def add_stats(self, stats):
+        self.stats.update(stats)
+
+    def stats_str(self):
+        hits = self.stats['hits']
+        disk_hits = self.stats['disk_hits']
+        misses = self.stats['misses']
+        total = hits + disk_hits + misses
+        ratio = 0.0 if total == 0 else 100 * (hits + disk_hits) / total
+        evictions = self.stats['evictions'] + self.lru.stats['evictions']
+        return f"feasible scheme cache: {hits} hits, {disk_hits} disk hits, {misses} misses ({ratio:.1f}% hit rate), {evictions} evictions"
+
+
+feasible_scheme_cache = FeasibleSchemeCache(getattr(settings, 'FEASIBLE_SCHEME_CACHE_SIZE', 100000))
+# worker processes do not run exit handlers, they flush with pop_stats or
+# after each task
+atexit.register(feasible_scheme_cache.flush)
+
+
+class ConfigDeltaCache:
+    """ Memoizes the differences of abstraction configs to AnICA's default
+    config (as computed by iwho's `config_diff`) by config fingerprint.
+
+    Each diff is stored together with a canonical string for it, so that
+    the diffs of several configs can be compared as sets.
+    """
+    def __init__(self, maxsize):
+        self.lru = LRUCache(maxsize)
+
+    @staticmethod
+    def namespace():
+        # the default config and the diffs depend on these packages
+        return f"config_delta:{package_version('anica')}:{package_version('iwho')}"
+
+    def get_many(self, fingerprints, compute):
+        """ Get a dict from the given config fingerprints to lists of (key,
+        diff) pairs. `compute` is called with a list of the fingerprints
+        that are not cached and has to return a dict from them to the lists
+        of diffs for their configs.
+        """
+        res = dict()
+        missing = []
+        for fingerprint in set(fingerprints):
+            delta = self.lru.get(fingerprint)
+            if delta is None:
+                missing.append(fingerprint)
+            else:
+                res[fingerprint] = delta
+        if len(missing) == 0:
+            return res
+
+        disk_cache = get_disk_cache()
+        if disk_cache is not None:
+            found = disk_cache.get_many(self.namespace(), missing)
+            for fingerprint, delta in found.items():
+                self.lru.put(fingerprint, delta)
+            res.update(found)
+            missing = [ fingerprint for fingerprint in missing if fingerprint not in found ]
+            if len(missing) == 0:
+                return res
+
+        computed = dict()
+        for fingerprint, diffs in compute(missing).items():
+            delta = [ (json.dumps(d, sort_keys=True, default=str), d) for d in diffs ]
+            self.lru.put(fingerprint, delta)
+            computed[fingerprint] = delta
+        if disk_cache is not None:
+            disk_cache.put_many(self.namespace(), computed.items())
+        res.update(computed)
+        return res
+
+
+config_delta_cache = ConfigDeltaCache(getattr(settings, 'CONFIG_DELTA_CACHE_SIZE', 10000))
+
+
+class FragmentCache:
+    """ Memoizes rendered HTML fragments (or tuples of them) by a key that
+    identifies their content. The namespace should contain a version of the
+    code that renders the fragments, so that they are invalidated when it
+    changes.
+    """
+    def __init__(self, namespace, maxsize):
+        self.namespace = namespace
+        self.lru = LRUCache(maxsize)
+
+    def get(self, key, compute):
+        """ Get the fragment for the key, calling `compute` without arguments
+        to render it if it is not cached.
+        """
+        res = self.lru.get(key)
+        if res is not None:
+            return res
+
+        disk_cache = get_disk_cache()
+        if disk_cache is not None:
+            res = disk_cache.get(self.namespace, key)
+            if res is not None:
+                self.lru.put(key, res)
+                return res
+
+        res = compute()
+        self.lru.put(key, res)
+        if disk_cache is not None:
+            disk_cache.put(self.namespace, key, res)
+        return res
+
+
+class ActxPool:
+    """ A pool of AbstractionContexts that are shared between requests (and
+    threads) of a process, keyed by the fingerprint of their config without
+    the predmanager, which is not needed in the UI.
+
+    Creating a context loads iwho's instruction data and feature managers and
+    therefore takes seconds. Code that may run in several threads, like the
+    views, has to use the contexts via `use`. Contexts are created by calling `factory` with
+    the config dict and evicted when they are the least recently used one
+    of more than `maxsize`.
+    """
+    def __init__(self, maxsize, factory):
+        self.lru = LRUCache(maxsize)
+        self.factory = factory
+        self.lock = threading.Lock()
+        self.creation_locks = dict()
+        self.stats = Counter()
+
+    def _count(self, kind):
+        with self.lock:
+            self.stats[kind] += 1
+
+    @staticmethod
+    def _prepare_config(config_dict):
+        # copy the config so that the caller's dict is not modified
+        config_dict = dict(config_dict)
+        config_dict['predmanager'] = None
+        return config_fingerprint(config_dict), config_dict
+
+    def get(self, config_dict):
+        """ Get the shared context for the config dict, creating it if it is
+        not in the pool.
+        """
+        key, config_dict = self._prepare_config(config_dict)
+        actx = self.lru.get(key)
+        if actx is not None:
+            self._count('hits')
+            return actx
+
+        # only one thread creates the context for a key, the others wait
+        with self.lock:
+            creation_lock = self.creation_locks.setdefault(key, threading.Lock())
+        with creation_lock:
+            actx = self.lru.get(key)
+            if actx is not None:
+                self._count('hits')
+                return actx
+            self._count('misses')
+            actx = self.factory(config_dict)
+            actx.pool_lock = threading.RLock()
+            self.lru.put(key, actx)
+        with self.lock:
+            self.creation_locks.pop(key, None)
+        return actx
+
+    @contextmanager
+    def use(self, config_dict):
+        """ Get the shared context for the config dict and hold its lock
+        while it is used. Neither the contexts nor the abstract blocks created
+        with them are thread-safe: loading blocks resolves json references and
+        looks up features, `prettify_absblock` counts element ids in the
+        context, and the measurement db has a single connection.
+        """
+        actx = self.get(config_dict)
+        with self.lock_for(actx):
+            yield actx
+
+    @staticmethod
+    def lock_for(actx):
+        """ The lock of a pooled context (see `use`). Contexts that are not
+        from a pool get a fresh lock.
+        """
+        res = getattr(actx, 'pool_lock', None)
+        if res is None:
+            res = threading.RLock()
+        return res
+
+    def warm_up(self, config_dicts):
+        """ Create the contexts for the given configs in advance, up to the
+        size of the pool, so that the first requests for them are fast.
+        Returns the number of distinct configs that are pooled.
+        """
+        keys = set()
+        for config_dict in config_dicts:
+            if len(keys) >= self.lru.maxsize:
+                break
+            key, _ = self._prepare_config(config_dict)
+            if key in keys:
+                continue
+            keys.add(key)
+            self.get(config_dict)
+        return len(keys)
+
+    def stats_str(self):
+        hits = self.stats['hits']
+        misses = self.stats['misses']
+        total = hits + misses
+        ratio = 0.0 if total == 0 else 100 * hits / total
+        evictions = self.lru.stats['evictions']
+        return f"abstraction context pool: {len(self.lru.entries)} contexts, {hits} hits, {misses} misses ({ratio:.1f}% hit rate), {evictions} evictions"
@@ -0,0 +1,335 @@
+""" The CPU-heavy part of computing coverage metrics for pairs of a campaign
+and a basic block set.
+
+The chunks of the pairs are handed to worker processes while the main
+process performs all database writes (see `compute_bbset_coverage` in
+models.py). The only database access in here is loading the discoveries of
+a campaign, once per process, so that they do not have to be sent along
+with every chunk.
+"""
+
+from collections import Counter, defaultdict
+import math
+import pickle
+import time
+
+import iwho
+
+from anica.bbset_coverage import get_table_metrics
+from anica.satsumption import check_subsumed
+
+from .caching import feasible_scheme_cache, get_disk_cache, package_version
+from .helpers import load_abstract_block
+from .instrumentation import phase, collect_phases
+
+
+# Parsing the basic blocks of a set is expensive and the same blocks are
+# usually interesting for several campaigns, so every process keeps the parsed
+# blocks of the set it worked on most recently around. Tasks are created in
+# order of basic block sets to make use of this.
+_last_parsed_bbs = (None, None)
+
+def _get_parsed_bbs(bbset_id):
+    global _last_parsed_bbs
+    key, parsed_bbs = _last_parsed_bbs
+    if key != bbset_id:
+        parsed_bbs = dict()
+        _last_parsed_bbs = (bbset_id, parsed_bbs)
+    return parsed_bbs
+
+
+def _bb_to_cache_entry(parsed_bb):
+    """ A representation of a parsed basic block that does not depend on the
+    iwho context: the scheme string, the operands, and the asm string of each
+    instruction. Returns None if it cannot be pickled.
+    """
+    try:
+        res = [ (str(insn.scheme), dict(insn.operands), str(insn)) for insn in parsed_bb.insns ]
+        pickle.dumps(res)
+    except Exception:
+        return None
+    return res
+
+
+def _bb_from_cache_entry(iwho_ctx, entry):
+    """ Reconstruct a basic block from its cache entry with the schemes of the
+    given context. Returns None if that does not reproduce the cached
+    instructions.
+    """
+    try:
+        insns = []
+        for scheme_str, operands, insn_str in entry:
+            insn = iwho_ctx.str_to_scheme[scheme_str].instantiate(operands)
+            if str(insn) != insn_str:
+                return None
+            insns.append(insn)
+        return iwho_ctx.make_bb(insns)
+    except Exception:
+        return None
+
+
+def parse_bbs(bbset_id, isa, entry_ids, asm_strs):
+    """ Get iwho basic blocks for the given entries of a basic block set,
+    reusing those that this process has parsed before.
+
+    Parsing and validating basic blocks is expensive, so parsed blocks are
+    also cached persistently (see caching.py), by their asm string, for the
+    isa and the installed iwho version. Blocks from the persistent cache are
+    reconstructed from the schemes and operands of their instructions.
+    """
+    parsed_bbs = _get_parsed_bbs(bbset_id)
+
+    missing = { entry_id: asm_str for entry_id, asm_str in zip(entry_ids, asm_strs) if entry_id not in parsed_bbs }
+    if len(missing) > 0:
+        iwho_ctx = iwho.get_context_by_name(isa)
+
+        disk_cache = get_disk_cache()
+        namespace = f"parsed_bb:{isa}:{package_version('iwho')}"
+        if disk_cache is not None:
+            with phase('load_cached_bbs') as load_phase:
+                cache_entries = disk_cache.get_many(namespace, set(missing.values()))
+                load_phase.add_rows(len(cache_entries))
+        else:
+            cache_entries = dict()
+
+        new_cache_entries = dict()
+        for entry_id, asm_str in missing.items():
+            parsed_bb = None
+            cache_entry = cache_entries.get(asm_str, None)
+            if cache_entry is not None:
+                parsed_bb = _bb_from_cache_entry(iwho_ctx, cache_entry)
+            if parsed_bb is None:
+                with phase('parse_bbs', rows=1):
+                    insns = iwho_ctx.parse_validated_asm(asm_str)
+                    parsed_bb = iwho_ctx.make_bb(insns)
+                cache_entry = _bb_to_cache_entry(parsed_bb)
+                if cache_entry is not None:
+                    new_cache_entries[asm_str] = cache_entry
+            # inject the entry id for later reference
+            parsed_bb.entry_id = entry_id
+            parsed_bbs[entry_id] = parsed_bb
+
+        if disk_cache is not None and len(new_cache_entries) > 0:
+            with phase('store_cached_bbs', rows=len(new_cache_entries)):
+                disk_cache.put_many(namespace, new_cache_entries.items())
+
+    return [ parsed_bbs[entry_id] for entry_id in entry_ids ]
+
+
+# Abstract instructions that admit more schemes than this are not put into
+# the SchemeIndex, they are assumed to admit every instruction.
+MAX_INDEXED_SCHEMES = 1024
+
+# number of the most general abstract blocks for the "top 10" metrics
+NUM_TOP_ABS = 10
+
+
+class SchemeIndex:
+    """ An inverted index from instruction scheme strings to the abstract
+    instructions of a list of abstract blocks that admit them, to find the
+    abstract blocks that can possibly subsume a basic block without the
+    expensive subsumption check.
+    """
+    def __init__(self, actx, all_abs):
+        self.num_abs_insns = [ len(ab.abs_insns) for ab in all_abs ]
+        # scheme string -> list of (abstract block index, abstract insn index)
+        self.scheme2abs_insns = defaultdict(list)
+        # abstract block index -> set of indices of unindexed abstract insns
+        self.wildcards = defaultdict(set)
+        for ab_idx, ab in enumerate(all_abs):
+            for ai_idx, ai in enumerate(ab.abs_insns):
+                feasible_schemes = feasible_scheme_cache.get_strs(actx, ai.features)
+                if len(feasible_schemes) > MAX_INDEXED_SCHEMES:
+                    self.wildcards[ab_idx].add(ai_idx)
+                else:
+                    for scheme_str in feasible_schemes:
+                        self.scheme2abs_insns[scheme_str].append((ab_idx, ai_idx))
+
+    def candidates(self, bb):
+        """ Get the (ascending) indices of the abstract blocks that can
+        subsume the basic block: each of their abstract instructions admits
+        the scheme of some instruction of the block, and the block has at
+        least as many instructions admitted by them as they have abstract
+        instructions.
+        """
+        scheme_counts = Counter(str(insn.scheme) for insn in bb.insns)
+        num_insns = len(bb.insns)
+
+        # abstract block index -> indices of abstract insns that admit an insn
+        matched = defaultdict(set)
+        # abstract block index -> number of admitted insns of the block
+        num_admitted = Counter()
+        for scheme_str, count in scheme_counts.items():
+            admitting_abs = set()
+            for ab_idx, ai_idx in self.scheme2abs_insns.get(scheme_str, ()):
+                matched[ab_idx].add(ai_idx)
+                admitting_abs.add(ab_idx)
+            for ab_idx in admitting_abs:
+                num_admitted[ab_idx] += count
+
+        res = []
+        for ab_idx in set(matched.keys()).union(self.wildcards.keys()):
+            wildcards = self.wildcards.get(ab_idx, set())
+            num_abs_insns = self.num_abs_insns[ab_idx]
+            if len(matched[ab_idx]) + len(wildcards - matched[ab_idx]) < num_abs_insns:
+                continue
+            if (num_insns if len(wildcards) > 0 else num_admitted[ab_idx]) < num_abs_insns:
+                continue
+            res.append(ab_idx)
+        res.sort()
+        return res
+
+
+def table_metrics_from_counts(num_interesting, num_covered, num_covered_top, total_num_bbs):
+    """ Assemble the metrics dict of a (campaign, basic block set) pair from
+    the numbers of interesting, covered and top-covered basic blocks.
+    """
+    def percent(num, total):
+        return 100 * num / total if total > 0 else 0.0
+
+    return {
+            'num_bbs_interesting': num_interesting,
+            'percent_bbs_interesting': percent(num_interesting, total_num_bbs),
+            'num_interesting_bbs_covered': num_covered,
+            'percent_interesting_bbs_covered': percent(num_covered, num_interesting),
+            'num_interesting_bbs_covered_top10': num_covered_top,
+            'percent_interesting_bbs_covered_top10': percent(num_covered_top, num_interesting),
+        }
+
+
+def compute_table_metrics(actx, all_abs, interesting_bbs, total_num_bbs, index=None):
+    """ Compute the same metrics as AnICA's `get_table_metrics`, but only run
+    the subsumption check for the abstract blocks that the SchemeIndex
+    reports as candidates for a basic block.
+
+    The abstract blocks need to be sorted by generality, the first
+    NUM_TOP_ABS of them are used for the "top 10" metrics. A SchemeIndex for
+    them can be passed if there is one already.
+
+    Besides the metrics, a list with the (ascending) indices of the abstract
+    blocks that subsume it is returned for each basic block.
+    """
+    if index is None:
+        with phase('scheme_index', rows=len(all_abs)):
+            index = SchemeIndex(actx, all_abs)
+
+    coverage = []
+    with phase('subsumption_checks') as check_phase:
+        for bb in interesting_bbs:
+            candidates = index.candidates(bb)
+            check_phase.add_rows(len(candidates))
+            coverage.append([ ab_idx for ab_idx in candidates if check_subsumed(bb, all_abs[ab_idx]) ])
+
+    num_covered = sum(1 for covering in coverage if len(covering) > 0)
+    num_covered_top = sum(1 for covering in coverage if len(covering) > 0 and covering[0] < NUM_TOP_ABS)
+
+    metrics = table_metrics_from_counts(len(interesting_bbs), num_covered, num_covered_top, total_num_bbs)
+    return metrics, coverage
+
+
+# The basic blocks of a pair are checked in several chunks (see
+# `compute_bbset_coverage` in models.py), so every process loads the abstract
+# blocks of a campaign's discoveries itself and keeps them (and their
+# SchemeIndex) around for the campaign it worked on most recently.
+_last_abstract_blocks = (None, None)
+
+def _get_abstract_blocks(task):
+    """ Get the abstraction context and the abstract blocks of the task's
+    discoveries, sorted by generality, and a dict for the SchemeIndex.
+    """
+    global _last_abstract_blocks
+    key = (task['campaign_id'], tuple(task['discovery_ids']))
+    last_key, loaded = _last_abstract_blocks
+    if last_key == key:
+        return loaded
+
+    # imported here, models.py uses this module
+    from .models import Discovery
+
+    discovery_ids = set(task['discovery_ids'])
+    with phase('load_abstract_blocks', rows=len(discovery_ids)):
+        discoveries = [ d for d in Discovery.objects.filter(batch__campaign_id=task['campaign_id'], subsumed_by=None).select_related('config').order_by('id')
+                if d.id in discovery_ids ]
+        if len(discoveries) != len(discovery_ids):
+            raise ValueError(f"discoveries of campaign {task['campaign_id']} changed during the coverage computation")
+
+        all_abs = []
+        actx = None
+        for d in discoveries:
+            ab = load_abstract_block(d.absblock, actx, d.get_config() if actx is None else None)
+            if actx is None:
+                actx = ab.actx
+            # inject the discovery id for later reference
+            ab.discovery_id = d.id
+            all_abs.append(ab)
+
+    all_abs.sort(key=lambda x: len(x.abs_insns))
+
+    loaded = (actx, all_abs, dict())
+    _last_abstract_blocks = (key, loaded)
+    return loaded
+
+
+def compute_chunk_metrics(task):
+    """ Compute the coverage metrics for a chunk of the interesting basic
+    blocks of a (campaign, basic block set) pair.
+
+    The task is a dict with the ids of the pair, the isa, ids and asm strings
+    of the interesting basic blocks of the chunk, the total number of basic
+    blocks of the set, the ids of the campaign's discoveries (which are
+    loaded from the database once per process), and the heuristic and verify
+    flags. Besides
+    the metrics for the chunk's basic blocks, the (entry id, discovery id)
+    pairs of the coverage relation, the wall time and the phase statistics
+    are returned, together with the chunk's entry ids.
+
+    With the heuristic flag, AnICA's `get_table_metrics` is used and the
+    coverage relation is not computed. With the verify flag, it is used in
+    addition to `compute_table_metrics` and differences are reported.
+    """
+    start = time.perf_counter()
+    coverage = None
+    with collect_phases() as phases:
+        with phase('coverage_chunk'):
+            interesting_bbs = parse_bbs(task['bbset_id'], task['isa'], task['entry_ids'], task['asm_strs'])
+
+            actx, all_abs, index_holder = _get_abstract_blocks(task)
+
+            if task['heuristic'] or task['verify']:
+                with phase('table_metrics', rows=len(interesting_bbs)):
+                    metrics = get_table_metrics(actx=actx, all_abs=all_abs, interesting_bbs=interesting_bbs, total_num_bbs=task['num_bbs'], heuristic=task['heuristic'])
+
+            if not task['heuristic']:
+                if 'index' not in index_holder:
+                    with phase('scheme_index', rows=len(all_abs)):
+                        index_holder['index'] = SchemeIndex(actx, all_abs)
+                with phase('indexed_table_metrics', rows=len(interesting_bbs)):
+                    indexed_metrics, bb_coverage = compute_table_metrics(actx, all_abs, interesting_bbs, task['num_bbs'], index=index_holder['index'])
+                if task['verify'] and _metrics_differ(metrics, indexed_metrics):
+                    print(f"coverage metrics for (campaign {task['campaign_id']}, bbset {task['bbset_id']}) differ: {metrics} from get_table_metrics, {indexed_metrics} with the scheme index")
+                metrics = indexed_metrics
+                coverage = [ (bb.entry_id, all_abs[ab_idx].discovery_id)
+                        for bb, covering in zip(interesting_bbs, bb_coverage) for ab_idx in covering ]
+
+    feasible_scheme_cache.flush()
+
+    return {
+            'campaign_id': task['campaign_id'],
+            'bbset_id': task['bbset_id'],
+            'entry_ids': task['entry_ids'],
+            'is_last': task['is_last'],
+            'metrics': metrics,
+            'coverage': coverage,
+            'seconds': time.perf_counter() - start,
+            'phases': phases,
+        }
+
+
+def _metrics_differ(expected, actual):
+    for k, v in expected.items():
+        if k.startswith('num_'):
+            if v != actual[k]:
+                return True
+        elif not math.isclose(v, actual[k], rel_tol=1e-9, abs_tol=1e-9):
+            return True
+    return False
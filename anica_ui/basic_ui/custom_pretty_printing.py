@@ -7,6 +7,19 @@ from django.utils.safestring import mark_safe
 from pathlib import Path
 import re
 
+from django.conf import settings
+
+from .caching import feasible_scheme_cache, FragmentCache, package_version
+
+# Increase this when the HTML produced for abstract blocks changes, to
+# invalidate the fragments in the absblock_html_cache.
+PRETTY_PRINTER_VERSION = 1
+
+# The fragments also contain the feasible schemes (from iwho, as decided by
+# anica) and links from iwho's instruction features.
+absblock_html_cache = FragmentCache(f"absblock_html:{PRETTY_PRINTER_VERSION}:{package_version('anica')}:{package_version('iwho')}",
+        getattr(settings, 'ABSBLOCK_HTML_CACHE_SIZE', 10000))
+
 # TODO we might want to use django methods to create this html in the first place
 
 def listify(ls, ordered=False):
@@ -73,14 +86,14 @@ def prettify_absblock(absblock, hl_expansion=None, skip_top=False, add_schemes=F
         insn_str = prettify_absinsn(ai, hl_feature, skip_top=skip_top)
         res += f"<td class=\"absinsn\">{insn_str}</td>"
 
-        feasible_schemes = actx.insn_feature_manager.compute_feasible_schemes(ai.features)
         if not add_schemes:
-            num_schemes = len(feasible_schemes)
+            num_schemes = len(feasible_scheme_cache.get_strs(actx, ai.features))
             res += f"<td class=\"absinsn\">({num_schemes})</td>"
 
         res += "\n</tr>\n"
 
         if add_schemes:
+            feasible_schemes = feasible_scheme_cache.get(actx, ai.features)
             content_id = "expl_schemes_{}_{}".format(prettify_id, idx)
             res += "<tr class=\"absinsn\"><td class=\"absinsn\"></td><td class=\"absinsn\">"
             res += "<div class=\"absinsn indent_content\">"
@@ -0,0 +1,170 @@
+""" Disassembly of the hex basic blocks of a basic block set.
+
+With an llvm-mc-based coder, every call to `hex2asm` runs a subprocess. To
+keep the number of calls low, many basic blocks are disassembled with a single
+call: they are concatenated with a separator instruction between them, which
+is then used to split the result again.
+
+Like discovery_parsing.py, nothing in here touches the database, so that
+batches can be handed to worker processes.
+"""
+
+from functools import partial
+import struct
+
+import iwho
+
+from .caching import get_disk_cache, package_version
+from .helpers import ordered_map
+
+
+# number of basic blocks that are disassembled together with one coder call
+DISASSEMBLY_BATCH_SIZE = 256
+
+# part of the cache namespace, to be increased whenever cached disassemblies
+# of earlier versions might be wrong
+DISASSEMBLY_VERSION = 2
+
+# An instruction per isa that is put between the basic blocks of a batch. It
+# should not occur in actual basic blocks, hence the odd immediate.
+_batch_separators = {
+        # movabs rax, 0x5eb1a1c4a5e9a7a3
+        'x86': '48b8' + struct.pack('<Q', 0x5eb1a1c4a5e9a7a3).hex(),
+    }
+
+# Bytes per isa that can prefix the separator instruction without changing its
+# disassembly (e.g., a superseded REX prefix before the REX.W of the movabs).
+# A block that ends in such a byte would silently lose it in a joined
+# disassembly, so these blocks are always disassembled on their own.
+_separator_prefix_bytes = {
+        'x86': frozenset([0x26, 0x2e, 0x36, 0x3e, 0x64, 0x65, 0x66, 0x67, 0xf0, 0xf2, 0xf3, *range(0x40, 0x50)]),
+    }
+
+
+# The contexts are expensive to create, so every process keeps them around.
+_iwho_ctxs = dict()
+
+def _get_iwho_ctx(isa):
+    res = _iwho_ctxs.get(isa, None)
+    if res is None:
+        res = iwho.get_context_by_name(isa)
+        _iwho_ctxs[isa] = res
+    return res
+
+
+# The disassembly of the separator instruction per isa, None if batching is
+# not possible.
+_separator_asms = dict()
+
+def _get_separator_asm(isa):
+    if isa not in _separator_asms:
+        res = None
+        sep_hex = _batch_separators.get(isa, None)
+        if sep_hex is not None:
+            try:
+                sep_lines = _get_iwho_ctx(isa).coder.hex2asm(sep_hex)
+                if len(sep_lines) == 1:
+                    res = sep_lines[0]
+            except Exception:
+                pass
+        _separator_asms[isa] = res
+    return _separator_asms[isa]
+
+
+def _disassemble_single(coder, hex_str):
+    return "\n".join(coder.hex2asm(hex_str))
+
+
+def _disassemble_joined(coder, sep_hex, sep_asm, hex_strs):
+    if len(hex_strs) <= 1:
+        return [_disassemble_single(coder, h) for h in hex_strs]
+
+    batch_hex = "".join(map(lambda x: x + sep_hex, hex_strs))
+    try:
+        lines = coder.hex2asm(batch_hex)
+    except Exception:
+        # a single invalid block makes the entire batch fail
+        lines = None
+
+    if lines is not None:
+        res = []
+        curr = []
+        for line in lines:
+            if line == sep_asm:
+                res.append("\n".join(curr))
+                curr = []
+            else:
+                curr.append(line)
+        if len(res) == len(hex_strs) and len(curr) == 0:
+            return res
+
+    # Split the batch to isolate the problematic blocks, they end up being
+    # disassembled on their own.
+    mid = len(hex_strs) // 2
+    return (_disassemble_joined(coder, sep_hex, sep_asm, hex_strs[:mid]) +
+            _disassemble_joined(coder, sep_hex, sep_asm, hex_strs[mid:]))
+
+
+def disassemble_batch(isa, hex_strs):
+    """ Disassemble a list of hex basic blocks, preferably with a single coder
+    call. Returns a list of corresponding asm strings with one instruction per
+    line.
+
+    If the result cannot be split unambiguously (e.g., because a basic block
+    ends in the middle of an instruction), the batch is split up until the
+    offending blocks are disassembled one by one. Blocks that end in a byte
+    that could prefix the separator are never joined.
+    """
+    coder = _get_iwho_ctx(isa).coder
+    sep_asm = _get_separator_asm(isa)
+    if sep_asm is None:
+        return [_disassemble_single(coder, h) for h in hex_strs]
+
+    prefix_bytes = _separator_prefix_bytes.get(isa, frozenset())
+    res = [None] * len(hex_strs)
+    joined_idxs = []
+    for idx, h in enumerate(hex_strs):
+        if len(h) >= 2 and int(h[-2:], 16) in prefix_bytes:
+            res[idx] = _disassemble_single(coder, h)
+        else:
+            joined_idxs.append(idx)
+
+    joined_hex_strs = [hex_strs[idx] for idx in joined_idxs]
+    for idx, asm_str in zip(joined_idxs, _disassemble_joined(coder, _batch_separators[isa], sep_asm, joined_hex_strs)):
+        res[idx] = asm_str
+    return res
+
+
+def disassemble_all(isa, hex_strs, executor=None):
+    """ Disassemble a sequence of hex basic blocks.
+
+    Results are cached persistently (see caching.py), only blocks that have not
+    been disassembled before are passed to the coder, in batches. If an
+    executor is given, the batches are disassembled with it.
+
+    Returns the list of corresponding asm strings and the number of distinct
+    blocks that were found in the cache.
+    """
+    disk_cache = get_disk_cache()
+    namespace = f"hex2asm:{DISASSEMBLY_VERSION}:{isa}:{package_version('iwho')}"
+
+    unique_hex_strs = list(dict.fromkeys(hex_strs))
+
+    if disk_cache is not None:
+        hex2asm = disk_cache.get_many(namespace, unique_hex_strs)
+    else:
+        hex2asm = dict()
+    num_cached = len(hex2asm)
+
+    missing = [h for h in unique_hex_strs if h not in hex2asm]
+    batches = [missing[i:i+DISASSEMBLY_BATCH_SIZE] for i in range(0, len(missing), DISASSEMBLY_BATCH_SIZE)]
+
+    results = ordered_map(partial(disassemble_batch, isa), batches, executor)
+
+    for batch, asm_strs in zip(batches, results):
+        new_entries = list(zip(batch, asm_strs))
+        hex2asm.update(new_entries)
+        if disk_cache is not None:
+            disk_cache.put_many(namespace, new_entries)
+
+    return [hex2asm[h] for h in hex_strs], num_cached
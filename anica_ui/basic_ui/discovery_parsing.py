@@ -0,0 +1,76 @@
+""" The CPU-heavy part of importing discoveries of a campaign.
+
+Nothing in here touches the database, so that these functions can be run in
+worker processes while a single process performs all database writes (see
+`import_campaigns` in models.py).
+"""
+
+import math
+from pathlib import Path
+
+from iwho.configurable import load_json_config
+
+from .caching import feasible_scheme_cache, config_fingerprint
+from .helpers import load_abstract_block, clear_doc_entries, make_remark_text
+from .instrumentation import phase, collect_phases
+
+
+def parse_discovery(campaign_dir, gen_id):
+    """ Load the discovery file with the given id from the campaign directory
+    and compute everything that is necessary to create a Discovery object for
+    it.
+
+    Returns None if there is no discovery file for the id.
+    """
+    base_dir = Path(campaign_dir)
+    ab_path = base_dir / 'discoveries' / f'{gen_id}.json'
+    if not ab_path.exists():
+        return None
+
+    with phase('load_json'):
+        absblock = load_json_config(ab_path)
+        clear_doc_entries(absblock)
+    num_insns = len(absblock['ab']['abs_insns'])
+
+    remark_text = make_remark_text(absblock.get('remarks', None))
+
+    # the AbstractionContext comes from the actx_pool of this process
+    with phase('load_abstract_block'):
+        ab = load_abstract_block(absblock, None)
+    actx = ab.actx
+
+    ischemes = set()
+    generality = math.inf
+    with phase('feasible_schemes'):
+        for ai in ab.abs_insns:
+            feasible_schemes = feasible_scheme_cache.get_strs(actx, ai.features)
+            generality = min(generality, len(feasible_schemes))
+            ischemes.update(feasible_schemes)
+
+    # The config is stored separately, it is the same for most discoveries.
+    config = absblock.pop('config')
+
+    return {
+            'identifier': gen_id,
+            'absblock': absblock,
+            'config': config,
+            'config_fingerprint': config_fingerprint(config),
+            'num_insns': num_insns,
+            'generality': generality,
+            'remarks': remark_text,
+            'ischemes': ischemes,
+        }
+
+
+def parse_discovery_chunk(campaign_dir, gen_ids):
+    """ Apply `parse_discovery` to a list of discovery ids.
+
+    Discoveries are handed to worker processes in chunks to keep the
+    communication overhead low. Besides the results, the statistics of the
+    feasible scheme cache and the phase statistics are returned, so that they
+    can be collected in the main process.
+    """
+    with collect_phases() as phases:
+        with phase('parse_discoveries', rows=len(gen_ids)):
+            res = [parse_discovery(campaign_dir, gen_id) for gen_id in gen_ids]
+    return res, feasible_scheme_cache.pop_stats(), phases
@@ -1,12 +1,30 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import django
+from django.conf import settings
+
 from anica.abstractblock import AbstractBlock
 from anica.abstractioncontext import AbstractionContext
 
+from .caching import ActxPool
+
+
+actx_pool = ActxPool(getattr(settings, 'ACTX_POOL_SIZE', 16), lambda config_dict: AbstractionContext(config=config_dict))
 
-def load_abstract_block(json_dict, actx):
+
+def load_abstract_block(json_dict, actx, config_dict=None):
+    """ Create an AbstractBlock from its json representation.
+
+    If no AbstractionContext is given, the one for the `config_dict`, or for
+    the config in the json dict if that is None, is taken from the actx_pool,
+    without holding its lock (see `ActxPool.use`).
+    """
     if actx is None:
-        config_dict = json_dict['config']
-        config_dict['predmanager'] = None # we don't need that one here
-        actx = AbstractionContext(config=config_dict)
+        if config_dict is None:
+            config_dict = json_dict['config']
+        actx = actx_pool.get(config_dict)
 
     # result_ref = json_dict['result_ref']
 
@@ -16,4 +34,60 @@ def load_abstract_block(json_dict, actx):
     return ab#, result_ref
 
 
+def clear_doc_entries(json_dict):
+    if isinstance(json_dict, dict):
+        for k in list(json_dict.keys()):
+            if k.endswith('.doc'):
+                del json_dict[k]
+            else:
+                clear_doc_entries(json_dict[k])
+    elif isinstance(json_dict, list) or isinstance(json_dict, tuple):
+        for i in json_dict:
+            clear_doc_entries(i)
+
+
+def make_remark_text(remarks):
+    if remarks is None:
+        return None
+
+    remark_strs = []
+    for r in remarks:
+        if isinstance(r, str):
+            remark_str = r
+        else:
+            assert isinstance(r, tuple) or isinstance(r, list)
+            remark_str = r[0].format(*r[1:])
+        remark_strs.append("<li>{}</li>".format(remark_str))
+    return "\n".join(remark_strs)
+
+
+def make_worker_pool(jobs):
+    """ Create a ProcessPoolExecutor with `jobs` worker processes.
+
+    The workers are only started at the first submit, when this process
+    usually has open database connections again (e.g., in a transaction).
+    They are therefore started from a forkserver instead of being forked
+    from this process, so that they do not inherit the connections, and
+    set up django on their own.
+    """
+    return ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('forkserver'), initializer=django.setup)
+
+
+def ordered_map(fun, iterable, executor=None, window=64):
+    """ Like `executor.map(fun, iterable)`, but only consume the iterable and
+    submit tasks up to `window` elements ahead of the results that have been
+    taken, so that neither the arguments nor the results pile up in memory.
+
+    Without an executor, this is the builtin map.
+    """
+    if executor is None:
+        yield from map(fun, iterable)
+        return
 
+    pending = deque()
+    for arg in iterable:
+        pending.append(executor.submit(fun, arg))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while len(pending) > 0:
+        yield pending.popleft().result()
@@ -0,0 +1,207 @@
+""" Instrumentation for the import management commands.
+
+Code that does expensive work marks its phases with `phase(name)`. For each
+phase, the wall time, the number of calls and processed rows, the number of
+SQL queries, and the peak resident set size of the process are recorded in
+the currently active Profile, if there is one. Phases are nested, their
+statistics include those of their sub-phases.
+
+The phases are also entered as `Timer.Sub`s of AnICA's Timer, so that they
+are part of its report together with the Timers within AnICA (if the Timer is
+enabled, see `profiled`).
+"""
+
+from contextlib import contextmanager
+import datetime
+import json
+import resource
+import sys
+import time
+
+from django.db import connection
+
+from anica.utils import Timer
+
+
+def _peak_rss_mb(who=resource.RUSAGE_SELF):
+    res = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in kilobytes on linux, but in bytes on macOS
+    if sys.platform == 'darwin':
+        res /= 1024
+    return res / 1024
+
+
+class PhaseStats:
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        self.rows = 0
+        self.queries = 0
+        self.peak_rss_mb = 0.0
+
+    def add_rows(self, num):
+        self.rows += num
+
+    def merge(self, other):
+        self.seconds += other.seconds
+        self.calls += other.calls
+        self.rows += other.rows
+        self.queries += other.queries
+        self.peak_rss_mb = max(self.peak_rss_mb, other.peak_rss_mb)
+
+    def to_json_dict(self):
+        return {
+                'seconds': self.seconds,
+                'calls': self.calls,
+                'rows': self.rows,
+                'rows_per_second': self.rows / self.seconds if self.seconds > 0 else None,
+                'queries': self.queries,
+                'peak_rss_mb': self.peak_rss_mb,
+            }
+
+
+class _NullPhase:
+    """ Stand-in for a PhaseStats object when nothing is profiled. """
+    def add_rows(self, num):
+        pass
+
+_null_phase = _NullPhase()
+
+
+class Profile:
+    """ Per-phase statistics, keyed by the '/'-separated path of nested phase
+    names.
+    """
+    current = None
+
+    def __init__(self, name):
+        self.name = name
+        self.phases = dict()
+        self.stack = []
+        self.num_queries = 0
+
+    def count_query(self, execute, sql, params, many, context):
+        self.num_queries += 1
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def phase(self, name):
+        self.stack.append(name)
+        key = "/".join(self.stack)
+        # register the phase here, so that parents come before their children
+        total_stats = self.phases.setdefault(key, PhaseStats())
+        stats = PhaseStats()
+        queries_before = self.num_queries
+        start = time.perf_counter()
+        try:
+            with Timer.Sub(name):
+                yield stats
+        finally:
+            stats.seconds = time.perf_counter() - start
+            stats.calls = 1
+            stats.queries = self.num_queries - queries_before
+            stats.peak_rss_mb = _peak_rss_mb()
+            self.stack.pop()
+            total_stats.merge(stats)
+
+    def merge(self, phases):
+        """ Add the phase statistics from another Profile (e.g., from a worker
+        process) as sub-phases of the currently active phase.
+        """
+        prefix = "".join(map(lambda x: x + "/", self.stack))
+        for key, stats in phases.items():
+            self.phases.setdefault(prefix + key, PhaseStats()).merge(stats)
+
+    def to_json_dict(self):
+        return {
+                'name': self.name,
+                'phases': { k: v.to_json_dict() for k, v in self.phases.items() },
+            }
+
+    def summary_str(self):
+        lines = []
+        header = "{:<60} {:>10} {:>7} {:>10} {:>10} {:>8} {:>9}".format(
+                "phase", "time [s]", "calls", "rows", "rows/s", "queries", "RSS [MB]")
+        lines.append(header)
+        lines.append("-" * len(header))
+        for key, stats in self.phases.items():
+            depth = key.count('/')
+            label = "  " * depth + key.rsplit('/', 1)[-1]
+            rate = "-" if stats.rows == 0 or stats.seconds == 0 else "{:.0f}".format(stats.rows / stats.seconds)
+            lines.append("{:<60} {:>10.2f} {:>7} {:>10} {:>10} {:>8} {:>9.1f}".format(
+                label, stats.seconds, stats.calls, stats.rows, rate, stats.queries, stats.peak_rss_mb))
+        return "\n".join(lines)
+
+
+@contextmanager
+def phase(name, rows=0):
+    """ Mark a phase of the computation for the current Profile.
+
+    The yielded object has an `add_rows(num)` method to record the number of
+    processed rows when it is not known up front.
+    """
+    profile = Profile.current
+    if profile is None:
+        yield _null_phase
+        return
+    with profile.phase(name) as stats:
+        stats.add_rows(rows)
+        yield stats
+
+
+@contextmanager
+def collect_phases():
+    """ Collect phase statistics in a fresh Profile, e.g., in a worker
+    process. The result can be passed to `merge_phases` in the main process.
+    """
+    outer = Profile.current
+    profile = Profile('worker')
+    Profile.current = profile
+    try:
+        yield profile.phases
+    finally:
+        Profile.current = outer
+
+
+def merge_phases(phases):
+    if Profile.current is not None:
+        Profile.current.merge(phases)
+
+
+@contextmanager
+def profiled(name, json_path=None):
+    """ Profile everything that happens in the context as phase `name`,
+    including all SQL queries of the default database connection.
+
+    If a `json_path` is given, the collected statistics are written there as
+    json, together with the report of AnICA's Timer, which is enabled for
+    this.
+    """
+    profile = Profile(name)
+    outer = Profile.current
+    Profile.current = profile
+
+    timer_enabled = Timer.enabled
+    if json_path is not None:
+        Timer.enabled = True
+
+    start_date = datetime.datetime.now().isoformat()
+    try:
+        with connection.execute_wrapper(profile.count_query):
+            with Timer(name) as timer:
+                with profile.phase(name):
+                    yield profile
+    finally:
+        Profile.current = outer
+        Timer.enabled = timer_enabled
+
+    if json_path is not None:
+        res = profile.to_json_dict()
+        res['start_date'] = start_date
+        res['argv'] = sys.argv
+        res['num_queries'] = profile.num_queries
+        res['peak_rss_mb'] = _peak_rss_mb()
+        res['peak_rss_children_mb'] = _peak_rss_mb(resource.RUSAGE_CHILDREN)
+        res['timer_report'] = timer.get_result()
+        with open(json_path, 'w') as f:
+            json.dump(res, f, indent=2)
@@ -0,0 +1,131 @@
+""" Evaluation of AnICA's InterestingnessMetric for entire columns of a
+measurement matrix (see measurement_matrix.py) at once.
+
+The vectorized computation mirrors `InterestingnessMetric.is_interesting`
+for blocks with positive results: they are interesting if the relative
+difference of the tool results, `(max - min) / sum * num_tools`, reaches the
+metric's `min_interestingness`. The operations are done in the same order as
+in the scalar code, so that the float results are identical.
+
+As the metric is defined in AnICA, all blocks whose verdict could differ
+between the two implementations are evaluated with the scalar
+implementation only: blocks with missing, zero or negative (i.e., error)
+results, whose treatment is up to the metric, and blocks whose
+interestingness is within a small relative distance of the threshold.
+Blocks spread over the range of interestingness values are evaluated with
+both. If the scalar verdict or interestingness differs for any of those (or
+the metric has unexpected parameters), the vectorized computation does not
+follow the metric's definition and the scalar implementation is used for all
+blocks.
+"""
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+# blocks whose interestingness is this close to the threshold (relative to
+# it, or absolutely for a threshold of 0) are evaluated with the scalar
+# implementation
+CHECK_RTOL = 1e-9
+CHECK_ATOL = 1e-12
+
+# number of blocks, evenly spread over the sorted interestingness values, that
+# are compared to the scalar implementation
+NUM_SPREAD_CHECKS = 256
+
+
+def _eval_res(tool_names, values):
+    return { t: { 'TP': float(v) } for t, v in zip(tool_names, values) }
+
+
+def is_interesting_scalar(metric, tool_names, results):
+    """ Evaluate the metric for each row of the (blocks x tools) `results`
+    matrix with the scalar implementation.
+    """
+    return np.fromiter((metric.is_interesting(_eval_res(tool_names, row)) for row in results.tolist()),
+            dtype=bool, count=results.shape[0])
+
+
+def _interestingness_vectorized(columns):
+    """ The interestingness of each block, inf for blocks with results <= 0.
+    """
+    num_tools = len(columns)
+    has_error = np.zeros(columns[0].shape, dtype=bool)
+    for c in columns:
+        has_error |= (c <= 0)
+
+    # summed up column by column like python's sum()
+    total = columns[0].copy()
+    for c in columns[1:]:
+        total += c
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        res = ((np.maximum.reduce(columns) - np.minimum.reduce(columns)) / total) * num_tools
+    res[has_error] = np.inf
+    return res
+
+
+def _is_interesting_vectorized(metric, columns):
+    """ Get the verdict and the interestingness per block, or None if the
+    metric cannot be evaluated this way.
+    """
+    min_interestingness = getattr(metric, 'min_interestingness', None)
+    if not isinstance(min_interestingness, (int, float)):
+        return None
+    invert = getattr(metric, 'invert_interestingness', False)
+    if not isinstance(invert, bool):
+        return None
+
+    interestingness = _interestingness_vectorized(columns)
+    res = interestingness >= min_interestingness
+    if invert:
+        res = ~res
+    return res, interestingness, min_interestingness
+
+
+def is_interesting_bulk(metric, tool_names, columns):
+    """ Evaluate the InterestingnessMetric for all blocks, given a float64
+    array per tool (in the order of `tool_names`) with their results.
+    Returns a boolean array with the verdict per block.
+    """
+    results = np.stack(columns, axis=1)
+    num_bbs = results.shape[0]
+    if num_bbs == 0:
+        return np.zeros(0, dtype=bool)
+
+    vectorized = _is_interesting_vectorized(metric, columns)
+    if vectorized is None:
+        return is_interesting_scalar(metric, tool_names, results)
+    res, interestingness, min_interestingness = vectorized
+
+    # Blocks close to the threshold can flip because of rounding, and blocks
+    # with missing (nan), zero or error results are not handled by the
+    # vectorized computation, they are evaluated with the scalar
+    # implementation only. Blocks spread over the range of interestingness
+    # values show whether the vectorized computation follows the metric.
+    has_nan = np.isnan(results).any(axis=1)
+    near_threshold = np.abs(interestingness - min_interestingness) <= max(CHECK_RTOL * abs(min_interestingness), CHECK_ATOL)
+    scalar_only = has_nan | near_threshold | (results <= 0).any(axis=1)
+    check = scalar_only.copy()
+    spread_idxs = np.flatnonzero(~scalar_only)
+    if len(spread_idxs) > 0:
+        order = spread_idxs[np.argsort(interestingness[spread_idxs], kind='stable')]
+        check[order[np.linspace(0, len(order) - 1, min(NUM_SPREAD_CHECKS, len(order))).astype(int)]] = True
+    check_idxs = np.flatnonzero(check)
+
+    expected = is_interesting_scalar(metric, tool_names, results[check_idxs])
+    must_agree = ~scalar_only[check_idxs]
+    agree_idxs = check_idxs[must_agree]
+    scalar_interestingness = np.fromiter((metric.compute_interestingness(_eval_res(tool_names, row)) for row in results[agree_idxs].tolist()),
+            dtype=np.float64, count=len(agree_idxs))
+    if (not np.allclose(scalar_interestingness, interestingness[agree_idxs], rtol=CHECK_RTOL, atol=0)
+            or not np.array_equal(expected[must_agree], res[agree_idxs])):
+        num_differing = int(np.count_nonzero(expected[must_agree] != res[agree_idxs]))
+        logger.warning(f"vectorized interestingness evaluation differs from the InterestingnessMetric ({num_differing} of {len(agree_idxs)} checked verdicts), falling back to the scalar evaluation")
+        return is_interesting_scalar(metric, tool_names, results)
+
+    res[check_idxs] = expected
+    return res
@@ -0,0 +1,108 @@
+""" Incremental reading of large json files.
+
+The json module can only decode complete documents. For the huge report files
+of long campaigns, we only want to keep a single entry of the top-level arrays
+in memory at a time. The helpers here read the file block-wise and decode one
+value at a time with `json.JSONDecoder.raw_decode`.
+"""
+
+import json
+
+_decoder = json.JSONDecoder()
+
+_whitespace = ' \t\n\r'
+
+# characters that can follow a complete value in a json document
+_delimiters = _whitespace + ',:]}'
+
+
+class _BlockReader:
+    def __init__(self, f, block_size=1 << 16):
+        self.f = f
+        self.block_size = block_size
+        self.buf = ""
+        self.pos = 0
+        self.at_eof = False
+
+    def fill(self):
+        """ Read more data into the buffer, return False if the end of the
+        file is reached.
+        """
+        if self.at_eof:
+            return False
+        # Grow the read size with the pending data, so that decoding a huge
+        # value does not take quadratic time.
+        data = self.f.read(max(self.block_size, len(self.buf) - self.pos))
+        if len(data) == 0:
+            self.at_eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """ Skip whitespace and return the next character ('' at the end of
+        the file).
+        """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _whitespace:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, chars):
+        c = self.peek()
+        if c == '' or c not in chars:
+            raise ValueError(f"malformed json: expected one of '{chars}', found '{c}'")
+        self.pos += 1
+        return c
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                val, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            if (end < len(self.buf) and self.buf[end] in _delimiters) or not self.fill():
+                self.pos = end
+                return val
+            # The value might have been cut off at the end of the buffer
+            # (e.g., a number before its '.' or exponent), decode it again
+            # with more data.
+
+
+def stream_json_object(path, array_key, block_size=1 << 16):
+    """ Iterate over the entries of the json object in the file at `path`.
+
+    Yields (key, value) pairs in the order of the file. The array under
+    `array_key` is not decoded as a whole, instead each of its elements is
+    yielded as an individual (array_key, element) pair.
+    """
+    with open(path, 'r') as f:
+        reader = _BlockReader(f, block_size)
+        reader.expect('{')
+        if reader.peek() == '}':
+            return
+        while True:
+            key = reader.value()
+            if not isinstance(key, str):
+                raise ValueError(f"malformed json: object key expected, found '{key}'")
+            reader.expect(':')
+            if key == array_key and reader.peek() == '[':
+                reader.expect('[')
+                if reader.peek() == ']':
+                    reader.expect(']')
+                else:
+                    while True:
+                        yield key, reader.value()
+                        if reader.expect(',]') == ']':
+                            break
+            else:
+                yield key, reader.value()
+            if reader.expect(',}') == '}':
+                return
@@ -1,4 +1,5 @@
 from django.core.management.base import BaseCommand, CommandError
+from basic_ui.instrumentation import profiled
 from basic_ui.models import compute_bbset_coverage
 
 
@@ -9,10 +10,16 @@ class Command(BaseCommand):
         parser.add_argument('--campaigns', nargs='*', default=[], type=int)
         parser.add_argument('--bbsets', nargs='*', default=[], type=int)
         parser.add_argument('--heuristic', action='store_true')
+        parser.add_argument('--verify', action='store_true', help="also compute the metrics without pruning subsumption checks and report differences")
+        parser.add_argument('--force', action='store_true', help="delete existing (complete or unfinished) results of the (campaign, bbset) pairs and compute them anew")
+        parser.add_argument('--jobs', type=int, default=1, help="number of worker processes for computing the coverage metrics")
+        parser.add_argument('--profile', type=str, default=None, metavar="FILE", help="write per-phase timing statistics as json to FILE")
 
     def handle(self, *args, **options):
         campaign_ids = options['campaigns']
         bbset_ids = options['bbsets']
-        compute_bbset_coverage(campaign_ids, bbset_ids, heuristic=options['heuristic'])
+        with profiled('compute_bbset_coverage', options['profile']) as profile:
+            compute_bbset_coverage(campaign_ids, bbset_ids, heuristic=options['heuristic'], jobs=options['jobs'], verify=options['verify'], force=options['force'])
         self.stdout.write(self.style.SUCCESS('Done computing coverage metrics.'))
+        self.stdout.write(profile.summary_str())
 
@@ -1,4 +1,5 @@
 from django.core.management.base import BaseCommand, CommandError
+from basic_ui.instrumentation import profiled
 from basic_ui.models import import_basic_block_set
 
 
@@ -7,6 +8,9 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('--isa', type=str, default="x86", help="instruction set architecture to assume when disassembling hex basic blocks (default: x86)")
+        parser.add_argument('--jobs', '-j', type=int, default=1, help="number of worker processes to use for disassembling basic blocks (default: 1)")
+        parser.add_argument('--resume', action='store_true', help="continue an interrupted import of the basic block set with this identifier")
+        parser.add_argument('--profile', type=str, default=None, metavar="FILE", help="write per-phase timing statistics as json to FILE")
         parser.add_argument('identifier', type=str, help="a unique identifier to refer to the basic block set in the UI")
         parser.add_argument('csv_file', type=str)
 
@@ -14,6 +18,11 @@ class Command(BaseCommand):
         isa = options['isa']
         identifier = options['identifier']
         csv_file = options['csv_file']
-        bbset_id = import_basic_block_set(isa, identifier, csv_file)
+        with profiled('import_bbset', options['profile']) as profile:
+            try:
+                bbset_id = import_basic_block_set(isa, identifier, csv_file, jobs=options['jobs'], resume=options['resume'])
+            except ValueError as e:
+                raise CommandError(str(e))
         self.stdout.write(self.style.SUCCESS('Successfully imported basic block set "{}" with id {}'.format(csv_file, bbset_id)))
+        self.stdout.write(profile.summary_str())
 
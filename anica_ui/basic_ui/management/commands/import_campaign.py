@@ -1,16 +1,23 @@
 from django.core.management.base import BaseCommand, CommandError
-from basic_ui.models import import_campaign
+from basic_ui.caching import feasible_scheme_cache
+from basic_ui.instrumentation import profiled
+from basic_ui.models import import_campaigns
 
 
 class Command(BaseCommand):
     help = 'Imports a campaign from each specified campaign directory'
 
     def add_arguments(self, parser):
+        parser.add_argument('--jobs', '-j', type=int, default=1, help="number of worker processes to use for parsing discoveries and computing missing metrics (default: 1)")
+        parser.add_argument('--append', action='store_true', help="add new batches and discoveries to campaigns that have already been imported, instead of skipping them")
+        parser.add_argument('--profile', type=str, default=None, metavar="FILE", help="write per-phase timing statistics as json to FILE")
         parser.add_argument('tag', type=str)
         parser.add_argument('campaign_dirs', nargs='+', type=str)
 
     def handle(self, *args, **options):
         tag = options['tag']
-        for campaign_dir in options['campaign_dirs']:
-            campaign_id = import_campaign(tag, campaign_dir)
-            self.stdout.write(self.style.SUCCESS('Successfully imported campaign "{}" with id {}'.format(campaign_dir, campaign_id)))
+        with profiled('import_campaign', options['profile']) as profile:
+            for campaign_dir, campaign_id in import_campaigns(tag, options['campaign_dirs'], jobs=options['jobs'], append=options['append']):
+                self.stdout.write(self.style.SUCCESS('Successfully imported campaign "{}" with id {}'.format(campaign_dir, campaign_id)))
+        self.stdout.write(feasible_scheme_cache.stats_str())
+        self.stdout.write(profile.summary_str())
@@ -1,4 +1,6 @@
 from django.core.management.base import BaseCommand, CommandError
+from basic_ui.caching import feasible_scheme_cache
+from basic_ui.instrumentation import profiled
 from basic_ui.models import import_generalization
 
 
@@ -6,10 +8,13 @@ class Command(BaseCommand):
     help = 'Imports a campaign from each specified campaign directory'
 
     def add_arguments(self, parser):
+        parser.add_argument('--profile', type=str, default=None, metavar="FILE", help="write per-phase timing statistics as json to FILE")
         parser.add_argument('generalization_dirs', nargs='+', type=str)
 
     def handle(self, *args, **options):
-        for gen_dir in options['generalization_dirs']:
-            import_generalization(gen_dir)
-            self.stdout.write(self.style.SUCCESS('Successfully imported generalization "{}"'.format(gen_dir)))
-
+        with profiled('import_generalization', options['profile']) as profile:
+            for gen_dir in options['generalization_dirs']:
+                import_generalization(gen_dir)
+                self.stdout.write(self.style.SUCCESS('Successfully imported generalization "{}"'.format(gen_dir)))
+        self.stdout.write(feasible_scheme_cache.stats_str())
+        self.stdout.write(profile.summary_str())
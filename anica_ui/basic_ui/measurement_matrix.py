@@ -0,0 +1,82 @@
+""" Columnar storage of the measurement results of basic block sets.
+
+The results of a BasicBlockSet are stored as a matrix with a row per basic
+block and a column per tool (in the order of `BasicBlockSet.tool_order`). The
+matrix is split into chunks of rows (BasicBlockMeasurementChunk objects), each
+of which is stored as binary blobs of float64 values together with the ids of
+the corresponding BasicBlockEntry objects.
+"""
+
+import numpy as np
+
+
+RESULT_DTYPE = np.dtype('<f8')
+ID_DTYPE = np.dtype('<i8')
+
+
+def encode_chunk(entry_ids, results):
+    """ Get the blobs for the entry ids and the (entries x tools) results
+    matrix of a chunk.
+    """
+    entry_ids = np.asarray(entry_ids, dtype=ID_DTYPE)
+    results = np.asarray(results, dtype=RESULT_DTYPE)
+    assert results.ndim == 2 and results.shape[0] == entry_ids.shape[0]
+    return entry_ids.tobytes(), results.tobytes()
+
+
+def decode_chunk(num_tools, entry_ids_blob, results_blob):
+    entry_ids = np.frombuffer(entry_ids_blob, dtype=ID_DTYPE)
+    results = np.frombuffer(results_blob, dtype=RESULT_DTYPE).reshape(-1, num_tools)
+    return entry_ids, results
+
+
+class MeasurementMatrix:
+    """ The measurement results of (a part of) a basic block set.
+
+    `results[i, j]` is the result of tool `tools[j]` for the basic block entry
+    with id `entry_ids[i]`.
+    """
+    def __init__(self, tools, entry_ids, results):
+        self.tools = list(tools)
+        self.entry_ids = entry_ids
+        self.results = results
+        self._tool2col = { t: i for i, t in enumerate(self.tools) }
+        self._id2row = None
+
+    @staticmethod
+    def from_blobs(tools, blobs):
+        """ Assemble a matrix from an iterable of (entry_ids_blob,
+        results_blob) pairs.
+        """
+        num_tools = len(tools)
+        id_parts = []
+        result_parts = []
+        for entry_ids_blob, results_blob in blobs:
+            entry_ids, results = decode_chunk(num_tools, entry_ids_blob, results_blob)
+            id_parts.append(entry_ids)
+            result_parts.append(results)
+        if len(id_parts) == 0:
+            return MeasurementMatrix(tools, np.zeros(0, dtype=ID_DTYPE), np.zeros((0, num_tools), dtype=RESULT_DTYPE))
+        return MeasurementMatrix(tools, np.concatenate(id_parts), np.concatenate(result_parts))
+
+    def __len__(self):
+        return len(self.entry_ids)
+
+    def column(self, tool):
+        """ The results of the given tool (name) for all entries. """
+        return self.results[:, self._tool2col[tool]]
+
+    def row_index(self, entry_id):
+        if self._id2row is None:
+            self._id2row = { int(e): i for i, e in enumerate(self.entry_ids) }
+        return self._id2row[entry_id]
+
+    def row(self, entry_id):
+        """ The results of all tools for the given entry id. """
+        return self.results[self.row_index(entry_id)]
+
+    def results_for(self, entry_id):
+        """ The results for the given entry id as a dict from tool names to
+        floats.
+        """
+        return dict(zip(self.tools, map(float, self.row(entry_id))))
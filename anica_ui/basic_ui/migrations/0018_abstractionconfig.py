@@ -0,0 +1,32 @@
+# Generated by Django 4.0.2 on 2026-10-17 19:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basic_ui', '0017_basicblockentry_measurement_results'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AbstractionConfig',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=64, unique=True)),
+                ('config', models.JSONField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='discovery',
+            name='config',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='basic_ui.abstractionconfig'),
+        ),
+        migrations.AddField(
+            model_name='generalization',
+            name='config',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='basic_ui.abstractionconfig'),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 4.0.2 on 2026-10-17 19:52
+
+from hashlib import sha256
+import json
+
+from django.db import migrations
+
+
+# number of rows that are rewritten at once
+CHUNK_SIZE = 1000
+
+
+def fingerprint(config_dict):
+    # the same as basic_ui.caching.config_fingerprint, copied here so that
+    # this migration does not change with the app code
+    canonical = json.dumps(config_dict, sort_keys=True, separators=(',', ':'))
+    return sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def json_size(obj):
+    return len(json.dumps(obj))
+
+
+def split_configs(apps, schema_editor):
+    AbstractionConfig = apps.get_model('basic_ui', 'AbstractionConfig')
+
+    fingerprint2config = dict()
+    def get_config(config_dict):
+        key = fingerprint(config_dict)
+        res = fingerprint2config.get(key, None)
+        if res is None:
+            res = AbstractionConfig.objects.get_or_create(fingerprint=key, defaults={'config': config_dict})[0]
+            fingerprint2config[key] = res
+        return res
+
+    size_before = 0
+    size_after = 0
+    for model_name in ('Discovery', 'Generalization'):
+        model = apps.get_model('basic_ui', model_name)
+        ids = list(model.objects.filter(config=None).values_list('id', flat=True))
+        for i in range(0, len(ids), CHUNK_SIZE):
+            objs = list(model.objects.filter(id__in=ids[i:i+CHUNK_SIZE]).only('id', 'absblock'))
+            changed_objs = []
+            for obj in objs:
+                size_before += json_size(obj.absblock)
+                config_dict = obj.absblock.pop('config', None)
+                if config_dict is not None:
+                    obj.config = get_config(config_dict)
+                    changed_objs.append(obj)
+                size_after += json_size(obj.absblock)
+            model.objects.bulk_update(changed_objs, ['absblock', 'config'])
+
+    if size_before > 0:
+        size_configs = sum(map(lambda x: json_size(x.config), fingerprint2config.values()))
+        size_after += size_configs
+        print(f"\n  abstract block json: {size_before / 1e6:.2f} MB before, {size_after / 1e6:.2f} MB after"
+              f" (including {len(fingerprint2config)} distinct configs with {size_configs / 1e6:.2f} MB),"
+              f" {100 * (1 - size_after / size_before):.1f}% less")
+
+
+def join_configs(apps, schema_editor):
+    for model_name in ('Discovery', 'Generalization'):
+        model = apps.get_model('basic_ui', model_name)
+        ids = list(model.objects.exclude(config=None).values_list('id', flat=True))
+        for i in range(0, len(ids), CHUNK_SIZE):
+            objs = list(model.objects.filter(id__in=ids[i:i+CHUNK_SIZE]).select_related('config').only('id', 'absblock', 'config__config'))
+            for obj in objs:
+                absblock = {'config': obj.config.config}
+                absblock.update(obj.absblock)
+                obj.absblock = absblock
+                obj.config = None
+            model.objects.bulk_update(objs, ['absblock', 'config'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basic_ui', '0018_abstractionconfig'),
+    ]
+
+    operations = [
+        migrations.RunPython(split_configs, join_configs),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.2 on 2026-10-17 20:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basic_ui', '0019_split_absblock_configs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basicblockset',
+            name='import_finished',
+            field=models.BooleanField(default=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.0.2 on 2026-10-17 20:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basic_ui', '0020_basicblockset_import_finished'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basicblockset',
+            name='tool_order',
+            field=models.JSONField(default=list),
+        ),
+        migrations.CreateModel(
+            name='BasicBlockMeasurementChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_entry_id', models.BigIntegerField()),
+                ('last_entry_id', models.BigIntegerField()),
+                ('entry_ids', models.BinaryField()),
+                ('results', models.BinaryField()),
+                ('bbset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='basic_ui.basicblockset')),
+            ],
+        ),
+    ]
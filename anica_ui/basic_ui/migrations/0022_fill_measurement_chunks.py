@@ -0,0 +1,95 @@
+# Generated by Django 4.0.2 on 2026-10-17 20:34
+
+from django.db import migrations
+import numpy as np
+
+
+# number of basic block entries per measurement chunk, as in
+# basic_ui.models.BBSET_CHUNK_SIZE
+CHUNK_SIZE = 10000
+
+
+def fill_chunks(apps, schema_editor):
+    BasicBlockSet = apps.get_model('basic_ui', 'BasicBlockSet')
+    BasicBlockMeasurement = apps.get_model('basic_ui', 'BasicBlockMeasurement')
+    BasicBlockMeasurementChunk = apps.get_model('basic_ui', 'BasicBlockMeasurementChunk')
+
+    for bbset in BasicBlockSet.objects.all():
+        BasicBlockMeasurementChunk.objects.filter(bbset=bbset).delete()
+        measurements = BasicBlockMeasurement.objects.filter(bb__bbset=bbset)
+        tools = { t.full_name for t in bbset.has_data_for.all() }
+        tools.update(measurements.values_list('tool__full_name', flat=True).distinct())
+        bbset.tool_order = sorted(tools)
+        bbset.save(update_fields=['tool_order'])
+        tool2col = { t: col for col, t in enumerate(bbset.tool_order) }
+
+        ids = list(bbset.basicblockentry_set.order_by('id').values_list('id', flat=True))
+        for i in range(0, len(ids), CHUNK_SIZE):
+            chunk_ids = ids[i:i+CHUNK_SIZE]
+            results = np.full((len(chunk_ids), len(bbset.tool_order)), np.nan, dtype='<f8')
+            id2row = { entry_id: row for row, entry_id in enumerate(chunk_ids) }
+
+            # Entries imported before migration 0017 have an empty
+            # measurement_results dict, the BasicBlockMeasurement rows are
+            # authoritative and override the dict.
+            entries = bbset.basicblockentry_set.filter(id__gte=chunk_ids[0], id__lte=chunk_ids[-1]).values_list('id', 'measurement_results')
+            for entry_id, measurement_results in entries.iterator():
+                for tool, res in measurement_results.items():
+                    col = tool2col.get(tool, None)
+                    if col is not None and res is not None:
+                        results[id2row[entry_id], col] = res
+            chunk_measurements = measurements.filter(bb_id__gte=chunk_ids[0], bb_id__lte=chunk_ids[-1]).values_list('bb_id', 'tool__full_name', 'result')
+            rows, cols, values = [], [], []
+            for entry_id, tool, res in chunk_measurements.iterator():
+                rows.append(id2row[entry_id])
+                cols.append(tool2col[tool])
+                values.append(res)
+            results[rows, cols] = values
+
+            # the measurement rows are deleted in the next migration, so every
+            # one of them has to end up in the chunk
+            lost = np.isnan(results[rows, cols]) & ~np.isnan(values)
+            if lost.any():
+                idx = int(np.flatnonzero(lost)[0])
+                raise RuntimeError(f"measurement of '{bbset.tool_order[cols[idx]]}' for basic block entry {chunk_ids[rows[idx]]} was not transferred to a chunk")
+
+            BasicBlockMeasurementChunk.objects.create(
+                    bbset=bbset,
+                    first_entry_id=chunk_ids[0],
+                    last_entry_id=chunk_ids[-1],
+                    entry_ids=np.asarray(chunk_ids, dtype='<i8').tobytes(),
+                    results=results.tobytes(),
+                )
+
+
+def restore_rows(apps, schema_editor):
+    BasicBlockSet = apps.get_model('basic_ui', 'BasicBlockSet')
+    BasicBlockEntry = apps.get_model('basic_ui', 'BasicBlockEntry')
+    BasicBlockMeasurement = apps.get_model('basic_ui', 'BasicBlockMeasurement')
+    Tool = apps.get_model('basic_ui', 'Tool')
+
+    for bbset in BasicBlockSet.objects.all():
+        tool_objs = [ Tool.objects.get(full_name=t) for t in bbset.tool_order ]
+        for chunk in bbset.basicblockmeasurementchunk_set.order_by('id'):
+            entry_ids = np.frombuffer(chunk.entry_ids, dtype='<i8').tolist()
+            results = np.frombuffer(chunk.results, dtype='<f8').reshape(len(entry_ids), -1).tolist()
+            entries = BasicBlockEntry.objects.in_bulk(entry_ids)
+            measurement_objs = []
+            for entry_id, row in zip(entry_ids, results):
+                entry = entries[entry_id]
+                entry.measurement_results = dict(zip(bbset.tool_order, row))
+                for tool_obj, res in zip(tool_objs, row):
+                    measurement_objs.append(BasicBlockMeasurement(bb=entry, tool=tool_obj, result=res))
+            BasicBlockEntry.objects.bulk_update(entries.values(), ['measurement_results'])
+            BasicBlockMeasurement.objects.bulk_create(measurement_objs)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basic_ui', '0021_basicblockmeasurementchunk'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_chunks, restore_rows),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.0.2 on 2026-10-17 20:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basic_ui', '0022_fill_measurement_chunks'),
+    ]
+
+    operations = [
+        # with a default, the field can be added back to existing rows when
+        # this migration is reversed
+        migrations.AlterField(
+            model_name='basicblockentry',
+            name='measurement_results',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.RemoveField(
+            model_name='basicblockentry',
+            name='measurement_results',
+        ),
+        migrations.DeleteModel(
+            name='BasicBlockMeasurement',
+        ),
+    ]
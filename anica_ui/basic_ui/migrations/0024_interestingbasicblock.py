@@ -0,0 +1,60 @@
+# Generated by Django 4.0.2 on 2026-10-17 21:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_bbsets(apps, schema_editor):
+    InterestingBasicBlock = apps.get_model('basic_ui', 'InterestingBasicBlock')
+    BasicBlockEntry = apps.get_model('basic_ui', 'BasicBlockEntry')
+    entry_bbset = BasicBlockEntry.objects.filter(id=models.OuterRef('entry_id')).values('bbset_id')[:1]
+    InterestingBasicBlock.objects.update(bbset_id=models.Subquery(entry_bbset))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basic_ui', '0023_remove_per_entry_measurements'),
+    ]
+
+    operations = [
+        # The through model of BasicBlockEntry.interesting_for becomes
+        # explicit, it keeps the table of the implicit one.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='InterestingBasicBlock',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='basic_ui.campaign')),
+                        ('entry', models.ForeignKey(db_column='basicblockentry_id', on_delete=django.db.models.deletion.CASCADE, to='basic_ui.basicblockentry')),
+                    ],
+                    options={
+                        'db_table': 'basic_ui_basicblockentry_interesting_for',
+                        'unique_together': {('entry', 'campaign')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='basicblockentry',
+                    name='interesting_for',
+                    field=models.ManyToManyField(related_name='interesting_bbs', through='basic_ui.InterestingBasicBlock', to='basic_ui.campaign'),
+                ),
+            ],
+            database_operations=[],
+        ),
+        migrations.AddField(
+            model_name='interestingbasicblock',
+            name='bbset',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='basic_ui.basicblockset'),
+        ),
+        migrations.RunPython(fill_bbsets, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='interestingbasicblock',
+            name='bbset',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='basic_ui.basicblockset'),
+        ),
+        migrations.AddIndex(
+            model_name='interestingbasicblock',
+            index=models.Index(fields=['campaign', 'bbset', 'entry'], name='basic_ui_ba_campaig_c955f0_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.0.2 on 2026-10-17 21:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basic_ui', '0024_interestingbasicblock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BasicBlockCoverage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bbset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='basic_ui.basicblockset')),
+                ('discovery', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='basic_ui.discovery')),
+                ('entry', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='basic_ui.basicblockentry')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['discovery', 'bbset', 'entry'], name='basic_ui_ba_discove_a665e1_idx'), models.Index(fields=['entry', 'discovery'], name='basic_ui_ba_entry_i_4a4469_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.0.2 on 2026-10-17 22:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basic_ui', '0025_basicblockcoverage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoverageProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('heuristic', models.BooleanField()),
+                ('num_interesting', models.IntegerField()),
+                ('last_entry_id', models.BigIntegerField(default=0)),
+                ('num_done', models.IntegerField(default=0)),
+                ('num_covered', models.IntegerField(default=0)),
+                ('num_covered_top10', models.IntegerField(default=0)),
+                ('bbset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='basic_ui.basicblockset')),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='basic_ui.campaign')),
+            ],
+            options={
+                'unique_together': {('campaign', 'bbset')},
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.0.2 on 2026-10-17 22:41
+
+from hashlib import sha256
+import json
+
+from django.db import migrations, models
+
+
+def fingerprint(config_dict):
+    # the same as basic_ui.caching.config_fingerprint, copied here so that
+    # this migration does not change with the app code
+    canonical = json.dumps(config_dict, sort_keys=True, separators=(',', ':'))
+    return sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def fill_config_fingerprints(apps, schema_editor):
+    Campaign = apps.get_model('basic_ui', 'Campaign')
+    campaigns = list(Campaign.objects.only('id', 'config_dict'))
+    for campaign in campaigns:
+        campaign.config_fingerprint = fingerprint(campaign.config_dict)
+    Campaign.objects.bulk_update(campaigns, ['config_fingerprint'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basic_ui', '0026_coverageprogress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='config_fingerprint',
+            field=models.CharField(default='', max_length=64),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_config_fingerprints, migrations.RunPython.noop),
+    ]
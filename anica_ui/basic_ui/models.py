@@ -1,11 +1,19 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, connection, transaction
+from django.db.models.functions import Coalesce
 from django.utils.dateparse import parse_datetime
 
 import csv
-from collections import defaultdict
+from collections import Counter, defaultdict, deque
+from functools import partial
+import itertools
 import json
 import math
 from pathlib import Path
+import threading
+import time
+
+import numpy as np
 
 from iwho.configurable import load_json_config
 import iwho
@@ -17,9 +25,16 @@ from anica.abstractblock import AbstractBlock
 from anica.abstractioncontext import AbstractionContext
 from anica.interestingness import InterestingnessMetric
 from anica.satsumption import check_subsumed
-from anica.bbset_coverage import get_table_metrics
 
-from .helpers import load_abstract_block
+from .caching import feasible_scheme_cache, config_fingerprint
+from .helpers import load_abstract_block, clear_doc_entries, make_remark_text, ordered_map, make_worker_pool, actx_pool
+from .discovery_parsing import parse_discovery_chunk
+from .disassembly import disassemble_all
+from .json_streaming import stream_json_object
+from .instrumentation import phase, merge_phases
+from .measurement_matrix import MeasurementMatrix, encode_chunk
+from .interestingness import is_interesting_bulk
+from .coverage import compute_chunk_metrics, table_metrics_from_counts
 
 import sys
 import os
@@ -37,6 +52,9 @@ class Campaign(models.Model):
     tag = models.CharField(max_length=255)
 
     config_dict = models.JSONField()
+    # the config_fingerprint of config_dict, to group campaigns by config
+    # without comparing the dicts
+    config_fingerprint = models.CharField(max_length=64)
     tools = models.ManyToManyField(Tool)
     termination_condition = models.JSONField()
 
@@ -55,6 +73,27 @@ class Campaign(models.Model):
     def __str__(self):
         return f"{self.host_pc} - {self.date}"
 
+    @staticmethod
+    def with_summary(campaigns):
+        """ Annotate a queryset of campaigns with the numbers of batches and
+        unsubsumed discoveries (`num_batches`, `num_discoveries`) and the
+        sample numbers of the first batch (`init_num_sampled`,
+        `init_num_interesting`) and prefetch their tools, so that the summary
+        of all campaigns takes a constant number of queries.
+        """
+        def count(model, campaign_field, **filter_kwargs):
+            query = model.objects.filter(**{campaign_field: models.OuterRef('pk')}, **filter_kwargs)
+            query = query.order_by().values(campaign_field).annotate(num=models.Count('pk')).values('num')
+            return Coalesce(models.Subquery(query), 0)
+
+        first_batch = DiscoveryBatch.objects.filter(campaign=models.OuterRef('pk')).order_by('pk')
+        return campaigns.annotate(
+                num_batches=count(DiscoveryBatch, 'campaign'),
+                num_discoveries=count(Discovery, 'batch__campaign', subsumed_by=None),
+                init_num_sampled=models.Subquery(first_batch.values('num_sampled')[:1]),
+                init_num_interesting=models.Subquery(first_batch.values('num_interesting')[:1]),
+            ).prefetch_related('tools')
+
 class DiscoveryBatch(models.Model):
     campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE)
     batch_index = models.IntegerField()
@@ -73,10 +112,74 @@ class InsnScheme(models.Model):
     def __str__(self):
         return self.text
 
-class Discovery(models.Model):
+class AbstractionConfig(models.Model):
+    """ An abstraction config, identified by a hash of its content.
+
+    Abstract blocks are stored without their config, which is usually shared
+    by a lot of them, and refer to one of these instead.
+    """
+    fingerprint = models.CharField(max_length=64, unique=True)
+    config = models.JSONField()
+
+def get_abstraction_config(config_dict, fingerprint=None):
+    if fingerprint is None:
+        fingerprint = config_fingerprint(config_dict)
+    return AbstractionConfig.objects.get_or_create(fingerprint=fingerprint, defaults={'config': config_dict})[0]
+
+def warm_up_actx_pool():
+    """ Create the AbstractionContexts for the configs of the most recently
+    imported campaigns and abstract blocks in the actx_pool.
+    """
+    def iter_configs():
+        yield from Campaign.objects.order_by('-id').values_list('config_dict', flat=True).iterator()
+        yield from AbstractionConfig.objects.order_by('-id').values_list('config', flat=True).iterator()
+
+    start = time.perf_counter()
+    num_configs = actx_pool.warm_up(iter_configs())
+    print(f"created abstraction contexts for {num_configs} configs in {time.perf_counter() - start:.1f}s")
+
+def start_actx_pool_warm_up():
+    """ Run `warm_up_actx_pool` in a background thread if ACTX_POOL_WARM_UP
+    is set. This is called by the server entry points (wsgi.py and asgi.py),
+    so that management commands do not create the contexts.
+    """
+    if getattr(settings, 'ACTX_POOL_WARM_UP', False):
+        threading.Thread(target=warm_up_actx_pool, daemon=True).start()
+
+class WithAbstractionConfig:
+    """ Access to the abstraction config of models with an `absblock` json
+    field and a `config` reference.
+    """
+    def get_config(self):
+        if self.config_id is None:
+            # not split off the absblock
+            return self.absblock.get('config', {})
+        return self.config.config
+
+    def get_absblock_json(self):
+        """ Get the json dict of the abstract block as it was imported,
+        including its config.
+        """
+        if self.config_id is None:
+            return self.absblock
+        res = {'config': self.config.config}
+        res.update(self.absblock)
+        return res
+
+    def get_absblock_fingerprint(self):
+        """ A hash that identifies the abstract block including its config
+        by content. If the config is split off, this uses its fingerprint,
+        so querysets of many objects should `select_related('config')`.
+        """
+        if self.config_id is None:
+            return config_fingerprint(self.absblock)
+        return config_fingerprint({'config_fingerprint': self.config.fingerprint, 'absblock': self.absblock})
+
+class Discovery(WithAbstractionConfig, models.Model):
     batch = models.ForeignKey(DiscoveryBatch, on_delete=models.CASCADE)
     identifier = models.CharField(max_length=63)
     absblock = models.JSONField()
+    config = models.ForeignKey(AbstractionConfig, null=True, on_delete=models.PROTECT)
     num_insns = models.IntegerField()
     witness_len = models.IntegerField()
     interestingness = models.FloatField(null=True)
@@ -97,8 +200,9 @@ class Witness(models.Model):
     discovery = models.OneToOneField(Discovery, on_delete=models.CASCADE)
 
 
-class Generalization(models.Model):
+class Generalization(WithAbstractionConfig, models.Model):
     absblock = models.JSONField()
+    config = models.ForeignKey(AbstractionConfig, null=True, on_delete=models.PROTECT)
     tools = models.ManyToManyField(Tool)
     witness_file = models.CharField(max_length=2048)
     witness_len = models.IntegerField()
@@ -114,18 +218,124 @@ class BasicBlockSet(models.Model):
     identifier = models.CharField(max_length=256, unique=True)
     isa = models.CharField(max_length=256)
     has_data_for = models.ManyToManyField(Tool)
+    # full names of the tools, in the order of the columns of the measurement
+    # matrix
+    tool_order = models.JSONField(default=list)
+    # False while the import is running (or if it was interrupted)
+    import_finished = models.BooleanField(default=True)
+
+    def get_measurements(self, entry_ids=None):
+        """ Get the measurement results of this set as a MeasurementMatrix
+        (see measurement_matrix.py), restricted to the chunks that contain the
+        given entry ids, if any.
+        """
+        chunks = self.basicblockmeasurementchunk_set.order_by('id')
+        if entry_ids is not None:
+            entry_ids = list(entry_ids)
+            if len(entry_ids) == 0:
+                chunks = chunks.none()
+            else:
+                chunks = chunks.filter(last_entry_id__gte=min(entry_ids), first_entry_id__lte=max(entry_ids))
+        blobs = chunks.values_list('entry_ids', 'results')
+        return MeasurementMatrix.from_blobs(self.tool_order, blobs)
 
 class BasicBlockEntry(models.Model):
     bbset = models.ForeignKey(BasicBlockSet, on_delete=models.CASCADE)
     asm_str = models.TextField()
     hex_str = models.TextField()
-    measurement_results = models.JSONField()
-    interesting_for = models.ManyToManyField(Campaign, related_name='interesting_bbs')
+    interesting_for = models.ManyToManyField(Campaign, related_name='interesting_bbs', through='InterestingBasicBlock')
 
-class BasicBlockMeasurement(models.Model):
-    bb = models.ForeignKey(BasicBlockEntry, on_delete=models.CASCADE)
-    tool = models.ForeignKey(Tool, on_delete=models.CASCADE)
-    result = models.FloatField()
+class InterestingBasicBlock(models.Model):
+    """ A basic block entry that is interesting for a campaign. The set of
+    the entry is stored here as well, to look up the interesting entries of a
+    (campaign, bbset) pair without a join.
+    """
+    entry = models.ForeignKey(BasicBlockEntry, on_delete=models.CASCADE, db_column='basicblockentry_id')
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE)
+    bbset = models.ForeignKey('BasicBlockSet', on_delete=models.CASCADE)
+
+    class Meta:
+        # the table of the previously implicit through model
+        db_table = 'basic_ui_basicblockentry_interesting_for'
+        unique_together = [('entry', 'campaign')]
+        indexes = [
+                models.Index(fields=['campaign', 'bbset', 'entry']),
+            ]
+
+    @staticmethod
+    def entry_ids_for(campaign_id, bbset_id):
+        """ Get the ids of the entries of the basic block set that are
+        interesting for the campaign, in ascending order.
+        """
+        query = InterestingBasicBlock.objects.filter(campaign_id=campaign_id, bbset_id=bbset_id)
+        return list(query.order_by('entry_id').values_list('entry_id', flat=True))
+
+    @staticmethod
+    def entries_for(campaign_id, bbset_id):
+        """ Get a queryset of the entries of the basic block set that are
+        interesting for the campaign.
+        """
+        return BasicBlockEntry.objects.filter(interestingbasicblock__campaign_id=campaign_id, interestingbasicblock__bbset_id=bbset_id)
+
+    @staticmethod
+    def exists_for(campaign_id, bbset_id):
+        return InterestingBasicBlock.objects.filter(campaign_id=campaign_id, bbset_id=bbset_id).exists()
+
+class BasicBlockCoverage(models.Model):
+    """ A (non-subsumed) discovery that subsumes a basic block entry which is
+    interesting for the discovery's campaign.
+    """
+    # the indices below also serve lookups by entry and discovery
+    entry = models.ForeignKey(BasicBlockEntry, on_delete=models.CASCADE, db_index=False)
+    discovery = models.ForeignKey('Discovery', on_delete=models.CASCADE, db_index=False)
+    bbset = models.ForeignKey('BasicBlockSet', on_delete=models.CASCADE)
+
+    class Meta:
+        indexes = [
+                models.Index(fields=['discovery', 'bbset', 'entry']),
+                models.Index(fields=['entry', 'discovery']),
+            ]
+
+    @staticmethod
+    def entries_covered_by(discovery_id, bbset_id):
+        """ Get a queryset of the entries of the basic block set that the
+        discovery covers.
+        """
+        return BasicBlockEntry.objects.filter(basicblockcoverage__discovery_id=discovery_id, basicblockcoverage__bbset_id=bbset_id)
+
+    @staticmethod
+    def discoveries_covering(entry_ids):
+        """ Get a dict from the given entry ids to lists of (campaign id,
+        discovery identifier) pairs of the discoveries that cover them.
+        """
+        res = defaultdict(list)
+        entry_ids = list(entry_ids)
+        for i in range(0, len(entry_ids), MAX_LOOKUP_PARAMS):
+            query = BasicBlockCoverage.objects.filter(entry_id__in=entry_ids[i:i+MAX_LOOKUP_PARAMS]).order_by('entry_id', 'discovery_id')
+            for entry_id, campaign_id, identifier in query.values_list('entry_id', 'discovery__batch__campaign_id', 'discovery__identifier'):
+                res[entry_id].append((campaign_id, identifier))
+        return res
+
+class BasicBlockMeasurementChunk(models.Model):
+    """ The measurement results for a range of entries of a BasicBlockSet, as
+    a block of rows of its measurement matrix.
+    """
+    bbset = models.ForeignKey(BasicBlockSet, on_delete=models.CASCADE)
+    first_entry_id = models.BigIntegerField()
+    last_entry_id = models.BigIntegerField()
+    entry_ids = models.BinaryField()
+    results = models.BinaryField()
+
+    @staticmethod
+    def create(bbset, entry_ids, results):
+        entry_ids_blob, results_blob = encode_chunk(entry_ids, results)
+        return BasicBlockMeasurementChunk(
+                bbset=bbset,
+                first_entry_id=min(entry_ids),
+                last_entry_id=max(entry_ids),
+                entry_ids=entry_ids_blob,
+                results=results_blob,
+            )
 
 class BasicBlockSetMetrics(models.Model):
     bbset = models.ForeignKey(BasicBlockSet, on_delete=models.CASCADE)
@@ -137,64 +347,381 @@ class BasicBlockSetMetrics(models.Model):
     num_interesting_bbs_covered_top10 = models.IntegerField()
     percent_interesting_bbs_covered_top10 = models.FloatField()
 
+class CoverageProgress(models.Model):
+    """ The progress of an unfinished coverage computation for a (campaign,
+    bbset) pair. The interesting basic blocks of the pair are checked in
+    order of their ids, the counts are those of the entries up to
+    `last_entry_id`. The object is deleted when the BasicBlockSetMetrics of
+    the pair are written.
+    """
+    bbset = models.ForeignKey(BasicBlockSet, on_delete=models.CASCADE)
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE)
+    heuristic = models.BooleanField()
+    num_interesting = models.IntegerField()
+    last_entry_id = models.BigIntegerField(default=0)
+    num_done = models.IntegerField(default=0)
+    num_covered = models.IntegerField(default=0)
+    num_covered_top10 = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [('campaign', 'bbset')]
+
+
+# maximal number of parameters to use in a single `__in` lookup, to stay below
+# the limits of sqlite
+MAX_LOOKUP_PARAMS = 500
+
+def bulk_create_with_ids(model, objs, key_field, **filter_kwargs):
+    """ Bulk-insert the given objects of the model and make sure that their
+    ids are set afterwards.
+
+    Most current db backends return the ids of bulk-inserted rows. For those
+    that do not, the ids are retrieved with additional queries for the values
+    of `key_field`, restricted by the given filter arguments. If several of
+    the objects share a key, their ids are assigned in ascending order, which
+    is the order in which they were inserted.
+    """
+    model.objects.bulk_create(objs)
+
+    if connection.features.can_return_rows_from_bulk_insert:
+        return
+
+    key2num_new = Counter(getattr(obj, key_field) for obj in objs)
+    keys = list(key2num_new.keys())
+    key2ids = defaultdict(deque)
+    for i in range(0, len(keys), MAX_LOOKUP_PARAMS):
+        lookup = {f'{key_field}__in': keys[i:i+MAX_LOOKUP_PARAMS]}
+        query = model.objects.filter(**filter_kwargs, **lookup).order_by('id')
+        for key, obj_id in query.values_list(key_field, 'id'):
+            key2ids[key].append(obj_id)
+
+    for key, ids in key2ids.items():
+        # rows that existed before with the same key have lower ids
+        while len(ids) > key2num_new[key]:
+            ids.popleft()
+
+    for obj in objs:
+        obj.id = key2ids[getattr(obj, key_field)].popleft()
+
+
+# number of csv rows that are imported (and committed) together
+BBSET_CHUNK_SIZE = 10000
+
+
+def _count_csv_rows(csv_file):
+    """ Get the number of lines of the csv file without the header, quickly.
+    This is only used for progress reports.
+    """
+    res = 0
+    with open(csv_file, 'rb') as f:
+        while True:
+            block = f.read(1 << 20)
+            if len(block) == 0:
+                break
+            res += block.count(b'\n')
+    return max(res - 1, 0)
+
+
+def import_basic_block_set(isa, identifier, csv_file, jobs=1, resume=False):
+    """ Import a basic block set from a csv file with a 'bb' column of hex
+    basic blocks and one column with measurements for each tool.
+
+    The file is read, disassembled and written in chunks of BBSET_CHUNK_SIZE
+    rows, each in its own transaction, so that the memory consumption does
+    not depend on the size of the set. The basic blocks are disassembled in
+    batches, in `jobs` worker processes if jobs > 1.
+
+    If `resume` is set and the import of a set with this identifier has been
+    interrupted before, it is continued after the last committed chunk.
+    """
+    bbset = BasicBlockSet.objects.filter(identifier=identifier).first()
+    num_done = 0
+    if bbset is not None:
+        if not resume or bbset.import_finished:
+            raise ValueError(f"a basic block set with identifier '{identifier}' has already been imported")
+        if bbset.isa != isa:
+            raise ValueError(f"cannot resume the import of basic block set '{identifier}' with a different isa")
+        num_done = bbset.basicblockentry_set.count()
+        print(f"resuming the import of basic block set '{identifier}' after {num_done} rows")
+
+    num_total = _count_csv_rows(csv_file)
 
-def import_basic_block_set(isa, identifier, csv_file):
-    data = []
     with open(csv_file) as f:
         reader = csv.DictReader(f)
         keys = set(reader.fieldnames)
-        for line in reader:
-            data.append(line)
 
-    assert 'bb' in keys, "Trying to import basic blocks from a csv file without 'bb' field!"
-    keys.discard('bb')
+        assert 'bb' in keys, "Trying to import basic blocks from a csv file without 'bb' field!"
+        keys.discard('bb')
+
+        if bbset is None:
+            bbset = _create_basic_block_set(isa, identifier, keys)
+        elif { t.full_name for t in bbset.has_data_for.all() } != keys:
+            raise ValueError(f"cannot resume the import of basic block set '{identifier}' with different tools")
+
+        if jobs > 1:
+            executor = make_worker_pool(jobs)
+        else:
+            executor = None
+
+        try:
+            lines = itertools.islice(reader, num_done, None)
+            start = time.perf_counter()
+            num_new = 0
+            while True:
+                with phase('read_csv') as read_phase:
+                    chunk = list(itertools.islice(lines, BBSET_CHUNK_SIZE))
+                    read_phase.add_rows(len(chunk))
+                if len(chunk) == 0:
+                    break
+
+                hex_strs = [line['bb'] for line in chunk]
+                with phase('disassemble', rows=len(chunk)):
+                    asm_strs, num_cached = disassemble_all(isa, hex_strs, executor)
+
+                _write_basic_block_chunk(bbset, chunk, asm_strs)
+
+                num_new += len(chunk)
+                num_done += len(chunk)
+                seconds = time.perf_counter() - start
+                rate = num_new / seconds
+                eta = max(num_total - num_done, 0) / rate
+                print(f"imported {num_done}/{num_total} rows ({100 * num_done / max(num_total, 1):.1f}%), {rate:.0f} rows/s, {num_cached} distinct blocks were in the disassembly cache, ETA {eta:.0f}s")
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    bbset.import_finished = True
+    bbset.save(update_fields=['import_finished'])
+
+    return bbset.id
 
-    iwho_ctx = iwho.get_context_by_name(isa)
 
-    tool_objs = { tool_name: Tool.objects.get_or_create(full_name=tool_name, defaults={})[0] for tool_name in keys }
+@transaction.atomic
+def _create_basic_block_set(isa, identifier, keys):
+    tool_objs = [ Tool.objects.get_or_create(full_name=tool_name, defaults={})[0] for tool_name in keys ]
 
-    bbset = BasicBlockSet(identifier=identifier, isa=isa)
+    bbset = BasicBlockSet(identifier=identifier, isa=isa, tool_order=sorted(keys), import_finished=False)
     bbset.save()
 
-    for k, obj in tool_objs.items():
+    for obj in tool_objs:
         bbset.has_data_for.add(obj)
 
-    bbentry_objs = []
-    for line in data:
-        hex_str = line['bb']
-        asm_str = "\n".join(iwho_ctx.coder.hex2asm(hex_str))
-        measurement_results = { k: float(v) for k, v in line.items() if k != 'bb'}
-        bbentry_objs.append(BasicBlockEntry(
-                bbset=bbset,
-                asm_str=asm_str,
-                hex_str=hex_str,
-                measurement_results=measurement_results,
-            ))
-    BasicBlockEntry.objects.bulk_create(bbentry_objs)
-
-    # obtain the created objects with proper IDs
-    bbentry_objs = BasicBlockEntry.objects.filter(bbset=bbset)
-
-    bbmeasurement_objs = []
-    for line, bbentry_obj in zip(data, bbentry_objs):
-        assert line['bb'] == bbentry_obj.hex_str
-
-        for k in keys:
-            bbmeasurement_objs.append(BasicBlockMeasurement(
-                    bb=bbentry_obj,
-                    tool=tool_objs[k],
-                    result=float(line[k]),
+    return bbset
+
+
+@transaction.atomic
+def _write_basic_block_chunk(bbset, chunk, asm_strs):
+    with phase('write_rows', rows=len(chunk)):
+        bbentry_objs = []
+        for line, asm_str in zip(chunk, asm_strs):
+            bbentry_objs.append(BasicBlockEntry(
+                    bbset=bbset,
+                    asm_str=asm_str,
+                    hex_str=line['bb'],
                 ))
-    BasicBlockMeasurement.objects.bulk_create(bbmeasurement_objs)
+        bulk_create_with_ids(BasicBlockEntry, bbentry_objs, 'hex_str', bbset=bbset)
 
-    return bbset.id
+        results = [ [ float(line[k]) for k in bbset.tool_order ] for line in chunk ]
+        BasicBlockMeasurementChunk.create(bbset, [ obj.id for obj in bbentry_objs ], results).save()
+
+
+# number of discoveries that are parsed together in one worker task
+DISCOVERY_CHUNK_SIZE = 32
+
+# number of discoveries whose rows are collected before writing them to the
+# database
+IMPORT_FLUSH_SIZE = 512
+
+
+def import_campaigns(tag, campaign_dirs, jobs=1, append=False):
+    """ Import a campaign from each of the given directories, yielding pairs
+    of the campaign directory and the id of the new Campaign object (None if
+    the campaign was skipped).
+
+    If jobs > 1, the discovery files are parsed in that many worker processes.
+    All database writes happen in the calling process.
+
+    See `import_campaign` for the meaning of `append`.
+    """
+    if jobs <= 1:
+        for campaign_dir in campaign_dirs:
+            yield campaign_dir, import_campaign(tag, campaign_dir, append=append)
+        return
+
+    with make_worker_pool(jobs) as executor:
+        for campaign_dir in campaign_dirs:
+            yield campaign_dir, import_campaign(tag, campaign_dir, executor=executor, append=append)
+
+
+class _DiscoveryWriter:
+    """ Collects the DiscoveryBatch and Discovery objects of a campaign
+    together with their related rows and writes them to the database with bulk
+    inserts whenever IMPORT_FLUSH_SIZE discoveries are pending.
+    """
+
+    def __init__(self, campaign, metrics_dict):
+        self.campaign = campaign
+        self.metrics_dict = metrics_dict
+
+        self.pending_batches = []
+        self.pending_discoveries = []
+
+        self.num_batches = 0
+        self.num_discoveries = 0
+
+        self.istr2obj = { obj.text: obj for obj in InsnScheme.objects.all() }
+
+        self.fingerprint2config = dict()
+
+    def get_config(self, config_dict, fingerprint):
+        res = self.fingerprint2config.get(fingerprint, None)
+        if res is None:
+            res = get_abstraction_config(config_dict, fingerprint)
+            self.fingerprint2config[fingerprint] = res
+        return res
+
+    def add_batch(self, batch_obj):
+        self.num_batches += 1
+        self.pending_batches.append(batch_obj)
+        if len(self.pending_batches) >= IMPORT_FLUSH_SIZE:
+            self.flush_batches()
+
+    def add_discovery(self, discovery_obj, ischemes):
+        self.num_discoveries += 1
+        self.pending_discoveries.append((discovery_obj, ischemes))
+        if len(self.pending_discoveries) >= IMPORT_FLUSH_SIZE:
+            self.flush()
+
+    def flush_batches(self):
+        if len(self.pending_batches) == 0:
+            return
+        with phase('write_batches', rows=len(self.pending_batches)):
+            bulk_create_with_ids(DiscoveryBatch, self.pending_batches, 'batch_index', campaign=self.campaign)
+        self.pending_batches = []
+
+    def flush(self):
+        # the discoveries refer to the batches, so these need to go first
+        self.flush_batches()
+
+        if len(self.pending_discoveries) == 0:
+            return
+
+        with phase('write_discoveries', rows=len(self.pending_discoveries)):
+            discovery_objs = [d for d, ischemes in self.pending_discoveries]
+            bulk_create_with_ids(Discovery, discovery_objs, 'identifier', batch__campaign=self.campaign)
+
+            required_ischemes = set()
+            for d, ischemes in self.pending_discoveries:
+                required_ischemes.update(ischemes)
+            required_ischemes.difference_update(self.istr2obj.keys())
+            if len(required_ischemes) > 0:
+                # make sure that the length of the text field is sufficient
+                assert all(map(lambda x: len(x) <= 255, required_ischemes))
+                new_objs = list(map(lambda x: InsnScheme(text=x), sorted(required_ischemes)))
+                bulk_create_with_ids(InsnScheme, new_objs, 'text')
+                for obj in new_objs:
+                    self.istr2obj[obj.text] = obj
+
+            # Discovery.occurring_insnschemes is a many-to-many relation. To fill
+            # such a relation using bulk inserts (which are essential for
+            # performance), we need to get a bit more creative: Many-to-many
+            # relationships in django are backed by a `through` model, which we
+            # obtain here. This is just a normal model, which we can fill in bulk.
+            discovery2ischeme_cls = Discovery.occurring_insnschemes.through
+
+            through_objs = []
+            measurement_objs = []
+            for discovery_obj, ischemes in self.pending_discoveries:
+                ident = discovery_obj.identifier
+                for istr in sorted(ischemes):
+                    insnscheme_obj = self.istr2obj[istr]
+                    through_objs.append(discovery2ischeme_cls(discovery_id=discovery_obj.id, insnscheme=insnscheme_obj))
+
+                ab_metrics = self.metrics_dict.get(ident, None)
+                if ab_metrics is not None:
+                    for interestingness in ab_metrics['interestingness_series']:
+                        measurement_objs.append(Measurement(discovery_id=discovery_obj.id, interestingness=interestingness))
+            Measurement.objects.bulk_create(measurement_objs)
+            discovery2ischeme_cls.objects.bulk_create(through_objs)
+
+        self.pending_discoveries = []
 
 
-def import_campaign(tag, campaign_dir):
+def _iter_discovery_chunks(report_path, campaign, writer, known_batches, known_discoveries):
+    """ Stream the per-batch statistics of the campaign report, register the
+    corresponding DiscoveryBatch objects with the writer and yield the
+    referenced discoveries in chunks of (batch_obj, gen_id, witness_len)
+    triples.
+
+    Batches whose index is a key of the `known_batches` dict are already in
+    the database and are not registered again, discoveries whose id is in the
+    `known_discoveries` set are skipped.
+    """
+    chunk = []
+    batch_index = 0
+    for key, batch_entry in stream_json_object(report_path, 'per_batch_stats'):
+        if key != 'per_batch_stats':
+            continue
+        batch_obj = known_batches.get(batch_index, None)
+        if batch_obj is None:
+            batch_obj = DiscoveryBatch(
+                    campaign=campaign,
+                    batch_index=batch_index,
+                    num_sampled=batch_entry['num_sampled'],
+                    num_interesting=batch_entry['num_interesting'],
+                    batch_time=batch_entry['batch_time'],
+                )
+            writer.add_batch(batch_obj)
+        batch_index += 1
+
+        for sample_entry in batch_entry['per_interesting_sample_stats']:
+            for gen_entry in sample_entry.get('per_generalization_stats', []):
+                if gen_entry['id'] in known_discoveries:
+                    continue
+                chunk.append((batch_obj, gen_entry['id'], gen_entry['witness_len']))
+                if len(chunk) >= DISCOVERY_CHUNK_SIZE:
+                    yield chunk
+                    chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def read_report_header(report_path):
+    """ Get the entries of a campaign's report.json except for the per-batch
+    statistics, without loading the entire file.
+    """
+    header = dict()
+    required_keys = {'start_date', 'seconds_passed', 'host_pc'}
+    for key, value in stream_json_object(report_path, 'per_batch_stats'):
+        if key == 'per_batch_stats':
+            continue
+        header[key] = value
+        if required_keys.issubset(header.keys()):
+            break
+    return header
+
+
+@transaction.atomic
+def import_campaign(tag, campaign_dir, executor=None, append=False):
+    """ Import the campaign from the given directory.
+
+    The report is streamed and rows are written in chunks, so that the memory
+    consumption does not grow with the length of the campaign.
+
+    If an executor (e.g., a ProcessPoolExecutor) is given, the discovery files
+    are parsed with it, as well as loaded for computing missing metrics.
+
+    Campaigns that have already been imported are skipped, unless `append` is
+    set. Then, only the batches and discoveries that are not yet in the
+    database are added to the existing campaign, e.g., to follow a campaign
+    that is still running.
+    """
     base_dir = Path(campaign_dir)
 
-    if not (base_dir / 'metrics.json').exists():
-        add_metrics_for_campaign_dir(campaign_dir)
+    if append or not (base_dir / 'metrics.json').exists():
+        # When appending, only the metrics of new discoveries are computed.
+        with phase('add_metrics'):
+            add_metrics_for_campaign_dir(campaign_dir, executor=executor, incremental=append)
 
     campaign_config = load_json_config(base_dir / "campaign_config.json")
 
@@ -204,11 +731,13 @@ def import_campaign(tag, campaign_dir):
 
     restrict_to_supported_insns = campaign_config['restrict_to_supported_insns']
 
-    report = load_json_config(base_dir / "report.json")
+    report_path = base_dir / "report.json"
+    with phase('read_report_header'):
+        report_header = read_report_header(report_path)
 
-    date = parse_datetime(report['start_date'])
-    total_seconds = report['seconds_passed']
-    host_pc = report['host_pc']
+    date = parse_datetime(report_header['start_date'])
+    total_seconds = report_header['seconds_passed']
+    host_pc = report_header['host_pc']
 
     # The better way would probably be to move/copy the files into the django
     # app's working space and to make this path relative to a fixed base. This
@@ -217,63 +746,50 @@ def import_campaign(tag, campaign_dir):
     witness_path = str((base_dir / 'witnesses').resolve())
 
     # avoid duplicate imports (this exploits the above implementation choice)
-    duplicate = Campaign.objects.filter(witness_path=witness_path)
-    if duplicate.exists():
+    campaign = Campaign.objects.filter(witness_path=witness_path).first()
+    if campaign is not None and not append:
         print(f"skipping campaign {campaign_dir} because it has alreadyh been imported")
         return
 
-    tool_objs = [Tool.objects.get_or_create(full_name=tool_name, defaults={})[0] for tool_name in tools]
+    if campaign is not None:
+        campaign.total_seconds = total_seconds
+        campaign.save(update_fields=['total_seconds'])
 
-    campaign = Campaign(
-            tag = tag,
-            config_dict = abstraction_config,
-            termination_condition = termination_condition,
-            date = date,
-            host_pc = host_pc,
-            total_seconds = total_seconds,
-            restrict_to_supported_insns = restrict_to_supported_insns,
-            witness_path = witness_path,
-        )
+        # These are all we need to know about the existing rows, since the
+        # report and the discovery files only grow while the campaign runs.
+        known_batches = { b.batch_index: b for b in DiscoveryBatch.objects.filter(campaign=campaign).only('id', 'batch_index') }
+        known_discoveries = set(Discovery.objects.filter(batch__campaign=campaign).values_list('identifier', flat=True))
+    else:
+        tool_objs = [Tool.objects.get_or_create(full_name=tool_name, defaults={})[0] for tool_name in tools]
 
-    campaign.save()
+        campaign = Campaign(
+                tag = tag,
+                config_dict = abstraction_config,
+                config_fingerprint = config_fingerprint(abstraction_config),
+                termination_condition = termination_condition,
+                date = date,
+                host_pc = host_pc,
+                total_seconds = total_seconds,
+                restrict_to_supported_insns = restrict_to_supported_insns,
+                witness_path = witness_path,
+            )
 
-    for t in tool_objs:
-        campaign.tools.add(t.id)
+        campaign.save()
+
+        for t in tool_objs:
+            campaign.tools.add(t.id)
+
+        known_batches = dict()
+        known_discoveries = set()
 
     # check whether there is a file containing metrics produced in a preprocessing step
     metrics_path = base_dir / 'metrics.json'
     if metrics_path.exists():
-        with open(metrics_path, 'r') as f:
+        with phase('load_metrics'), open(metrics_path, 'r') as f:
             metrics_dict = json.load(f)
     else:
         metrics_dict = {}
 
-    # Create all the batch and sample objects
-    # Bulk creation is key here for reasonable performance!
-
-    batch_objs = []
-    for batch_index, batch_entry in enumerate(report['per_batch_stats']):
-        num_sampled = batch_entry['num_sampled']
-        num_interesting = batch_entry['num_interesting']
-        batch_time = batch_entry['batch_time']
-        batch_objs.append(DiscoveryBatch(
-                campaign=campaign,
-                batch_index=batch_index,
-                num_sampled=num_sampled,
-                num_interesting=num_interesting,
-                batch_time=batch_time,
-            ))
-    DiscoveryBatch.objects.bulk_create(batch_objs)
-
-    # We need to retrieve the bulk-inserted objects with an additional query,
-    # since most db backends do not provide the ids of bulk-inserted objects.
-    # Nevertheless, this is a lot faster than creating each batch object
-    # individually.
-    batch_objs = DiscoveryBatch.objects.filter(campaign=campaign)
-
-    ischeme_map = defaultdict(set)
-    used_ischemes = set()
-
     # TODO make this work
     # if restrict_to_supported_insns:
     #     # respect the restriction to the supported instructions, so that the generality is computed correctly here
@@ -283,46 +799,31 @@ def import_campaign(tag, campaign_dir):
     #
     # actx = AbstractionContext(config=abstraction_config, restrict_to_insns_for=rest_keys)
 
-    actx = None
-
-    discovery_objs = []
-    for batch_entry, batch_obj in zip(report['per_batch_stats'], batch_objs):
-        for sample_entry in batch_entry['per_interesting_sample_stats']:
-            for gen_entry in sample_entry.get('per_generalization_stats', []):
-                gen_id = gen_entry['id']
-                ab_path = base_dir / 'discoveries' / f'{gen_id}.json'
-                if not ab_path.exists():
+    # Create all the batch and sample objects
+    # Bulk creation is key here for reasonable performance!
+    writer = _DiscoveryWriter(campaign, metrics_dict)
+
+    # Loading the abstract blocks and computing their feasible schemes is the
+    # expensive part here. It does not require database access, so we can
+    # hand it to worker processes if an executor is given. ordered_map
+    # preserves the order, so that the resulting rows are the same as for a
+    # sequential import.
+    pending_chunks = deque()
+    def gen_id_chunks():
+        for chunk in _iter_discovery_chunks(report_path, campaign, writer, known_batches, known_discoveries):
+            pending_chunks.append(chunk)
+            yield [gen_id for batch_obj, gen_id, witness_len in chunk]
+
+    parse_fun = partial(parse_discovery_chunk, str(base_dir))
+
+    with phase('discoveries') as discoveries_phase:
+        for parsed_chunk, cache_stats, parse_phases in ordered_map(parse_fun, gen_id_chunks(), executor):
+            feasible_scheme_cache.add_stats(cache_stats)
+            merge_phases(parse_phases)
+            chunk = pending_chunks.popleft()
+            for (batch_obj, gen_id, witness_len), parsed in zip(chunk, parsed_chunk):
+                if parsed is None:
                     continue
-                absblock = load_json_config(ab_path)
-                clear_doc_entries(absblock)
-                num_insns = len(absblock['ab']['abs_insns'])
-                witness_len = gen_entry['witness_len']
-
-                remarks = absblock.get('remarks', None)
-                if remarks is None:
-                    remark_text = None
-                else:
-                    remark_strs = []
-                    for r in remarks:
-                        if isinstance(r, str):
-                            remark_str = r
-                        else:
-                            assert isinstance(r, tuple) or isinstance(r, list)
-                            remark_str = r[0].format(*r[1:])
-                        remark_strs.append("<li>{}</li>".format(remark_str))
-                    remark_text = "\n".join(remark_strs)
-
-                ab = load_abstract_block(absblock, actx)
-                if actx is None:
-                    actx = ab.actx
-
-                generality = math.inf
-                for ai in ab.abs_insns:
-                    feasible_schemes = actx.insn_feature_manager.compute_feasible_schemes(ai.features)
-                    generality = min(generality, len(feasible_schemes))
-                    for istr in map(str, feasible_schemes):
-                        used_ischemes.add(istr)
-                        ischeme_map[gen_id].add(istr)
 
                 ab_metrics = metrics_dict.get(gen_id, None)
                 if ab_metrics is not None:
@@ -332,150 +833,290 @@ def import_campaign(tag, campaign_dir):
                     mean_interestingness = None
                     subsumed_by = None
 
-                discovery_objs.append(Discovery(
+                discovery_obj = Discovery(
                         batch = batch_obj,
                         identifier = gen_id,
-                        absblock = absblock,
-                        num_insns = num_insns,
+                        absblock = parsed['absblock'],
+                        config = writer.get_config(parsed['config'], parsed['config_fingerprint']),
+                        num_insns = parsed['num_insns'],
                         witness_len = witness_len,
                         interestingness = mean_interestingness,
                         subsumed_by = subsumed_by,
-                        generality = generality,
-                        remarks = remark_text,
-                    ))
-    Discovery.objects.bulk_create(discovery_objs)
-
-    existing_ischemes = set(map(lambda x: x.text, InsnScheme.objects.all()))
-    required_ischemes = used_ischemes - existing_ischemes
-    if len(required_ischemes) > 0:
-        # make sure that the length of the text field is sufficient
-        assert all(map(lambda x: len(x) <= 255, required_ischemes))
-        InsnScheme.objects.bulk_create(list(map(lambda x: InsnScheme(text=x), required_ischemes)))
-
-    ischeme_objs = InsnScheme.objects.all()
-    istr2obj = { obj.text: obj for obj in ischeme_objs }
-
-    # Discovery.occurring_insnschemes is a many-to-many relation. To fill such a
-    # relation using bulk inserts (which are essential for performance), we
-    # need to get a bit more creative: Many-to-many relationships in django are
-    # backed by a `through` model, which we obtain here. This is just a normal
-    # model, which we can fill in bulk.
-    discovery2ischeme_cls = Discovery.occurring_insnschemes.through
-
-    through_objs = []
-
-    # We need to retrieve the bulk-inserted objects with an additional query,
-    # since most db backends do not provide the ids of bulk-inserted objects.
-    # Nevertheless, this is a lot faster than creating each discovery object
-    # individually.
-    discovery_objs = Discovery.objects.filter(batch__campaign=campaign)
-    measurement_objs = []
-    for discovery_obj in discovery_objs:
-        ident = discovery_obj.identifier
-        for istr in ischeme_map[ident]:
-            insnscheme_obj = istr2obj[istr]
-            through_objs.append(discovery2ischeme_cls(discovery=discovery_obj, insnscheme=insnscheme_obj))
-
-        ab_metrics = metrics_dict.get(ident, None)
-        if ab_metrics is not None:
-            for interestingness in ab_metrics['interestingness_series']:
-                measurement_objs.append(Measurement(discovery=discovery_obj, interestingness=interestingness))
-    Measurement.objects.bulk_create(measurement_objs)
-    discovery2ischeme_cls.objects.bulk_create(through_objs)
+                        generality = parsed['generality'],
+                        remarks = parsed['remarks'],
+                    )
+                writer.add_discovery(discovery_obj, parsed['ischemes'])
+                discoveries_phase.add_rows(1)
+
+        writer.flush()
+
+    if len(known_discoveries) > 0:
+        # the new discoveries can subsume previously imported ones
+        with phase('update_subsumed_by') as update_phase:
+            updated = []
+            for d in Discovery.objects.filter(batch__campaign=campaign, subsumed_by=None).only('id', 'identifier'):
+                subsumed_by = metrics_dict.get(d.identifier, {}).get('subsumed_by', None)
+                if subsumed_by is not None:
+                    d.subsumed_by = subsumed_by
+                    updated.append(d)
+            Discovery.objects.bulk_update(updated, ['subsumed_by'], batch_size=IMPORT_FLUSH_SIZE)
+            update_phase.add_rows(len(updated))
+
+    if append:
+        print(f"added {writer.num_batches} batches and {writer.num_discoveries} discoveries to campaign {campaign_dir}")
 
     return campaign.id
 
-def compute_bbset_coverage(campaign_id_seq, bbset_id_seq, heuristic=False):
-    """ Compute metrics on how many basic blocks from the specified BBSets are
-    covered by the specified Campaigns.
-    Both parameters should be sequences of numerical identifiers of
-    corresponding data model objects. Pass empty lists to consider all
-    registered entities.
+# number of interesting basic blocks per coverage task, progress is stored
+# after each of them
+COVERAGE_CHUNK_SIZE = 2000
+
+@transaction.atomic
+def _invalidate_coverage(campaign_id, bbset_id):
+    """ Delete all coverage results (complete or not) of a (campaign, bbset)
+    pair.
     """
-    if len(campaign_id_seq) == 0:
-        campaign_id_seq = [ x.id for x in Campaign.objects.all() ]
+    BasicBlockSetMetrics.objects.filter(campaign_id=campaign_id, bbset_id=bbset_id).delete()
+    CoverageProgress.objects.filter(campaign_id=campaign_id, bbset_id=bbset_id).delete()
+    BasicBlockCoverage.objects.filter(discovery__batch__campaign_id=campaign_id, bbset_id=bbset_id).delete()
+    InterestingBasicBlock.objects.filter(campaign_id=campaign_id, bbset_id=bbset_id).delete()
 
-    if len(bbset_id_seq) == 0:
-        bbset_id_seq = [ x.id for x in BasicBlockSet.objects.all() ]
 
+def _coverage_pairs(campaign_id_seq, bbset_id_seq, heuristic, force):
+    """ Get the (bbset, campaign) pairs for which coverage metrics need to be
+    computed, grouped by basic block set.
+
+    With `force`, existing results of the pairs are deleted, otherwise pairs
+    with metrics are skipped and unfinished computations are resumed.
+    """
+    res = []
     for bbset_id in bbset_id_seq:
         bbset = BasicBlockSet.objects.get(pk=bbset_id)
 
-        # produce iwho basic blocks
-        isa = bbset.isa
-        iwho_ctx = iwho.get_context_by_name(isa)
-
-        all_bbentries = list(bbset.basicblockentry_set.all())
-        num_bbs = len(all_bbentries)
-        # for caching parsing results
-        parsed_bbs = dict()
+        if not bbset.import_finished:
+            print(f"skipping bbset {bbset_id} because its import has not finished")
+            continue
 
         for campaign_id in campaign_id_seq:
             campaign = Campaign.objects.get(pk=campaign_id)
-            config_dict = campaign.config_dict
             tools = campaign.tools.all()
 
-            # avoid duplicate computations
-            relevant_metrics = BasicBlockSetMetrics.objects.filter(bbset=bbset, campaign=campaign)
-            relevant_interestingness = BasicBlockEntry.interesting_for.through.objects.filter(campaign_id=campaign_id, basicblockentry_id__bbset=bbset)
-            data_present = relevant_metrics.exists() or relevant_interestingness.exists()
-            if data_present:
-                print(f"skipping (campaign {campaign_id}, bbset {bbset_id}) because metrics are already present")
-                continue
-
             tools_without_measurements = tools.difference(bbset.has_data_for.all())
             if tools_without_measurements.count() > 0:
                 print("skipping (campaign {}, bbset {}) because necessary measurements are not present for {}".format(
                     campaign_id, bbset_id, [t.full_name for t in tools_without_measurements]))
                 continue
 
-            print(f"computing coverage metrics for (campaign {campaign_id}, bbset {bbset_id})")
+            if force:
+                _invalidate_coverage(campaign_id, bbset_id)
+                res.append((bbset, campaign))
+                continue
+
+            # avoid duplicate computations
+            if BasicBlockSetMetrics.objects.filter(bbset=bbset, campaign=campaign).exists():
+                print(f"skipping (campaign {campaign_id}, bbset {bbset_id}) because metrics are already present")
+                continue
+
+            progress = CoverageProgress.objects.filter(campaign=campaign, bbset=bbset).first()
+            if progress is None:
+                if InterestingBasicBlock.exists_for(campaign_id, bbset_id):
+                    # left behind by an interrupted run without progress
+                    # information, there is nothing to resume
+                    print(f"discarding incomplete results for (campaign {campaign_id}, bbset {bbset_id})")
+                    _invalidate_coverage(campaign_id, bbset_id)
+            elif progress.heuristic != heuristic:
+                print(f"skipping (campaign {campaign_id}, bbset {bbset_id}) because an unfinished computation {'with' if progress.heuristic else 'without'} --heuristic exists, use --force to restart it")
+                continue
+
+            res.append((bbset, campaign))
+    return res
+
 
-            tool_names = [ t.full_name for t in tools ]
+@transaction.atomic
+def _start_coverage(campaign_id, bbset_id, interesting_entry_ids, heuristic):
+    InterestingBasicBlock.objects.bulk_create([
+            InterestingBasicBlock(entry_id=entry_id, campaign_id=campaign_id, bbset_id=bbset_id)
+            for entry_id in interesting_entry_ids
+        ], batch_size=BBSET_CHUNK_SIZE)
 
-            interestingness_config = config_dict.get('interestingness_metric', {})
+    return CoverageProgress.objects.create(campaign_id=campaign_id, bbset_id=bbset_id,
+            heuristic=heuristic, num_interesting=len(interesting_entry_ids))
+
+
+def _coverage_tasks(pairs, heuristic, verify, pair2progress):
+    """ Produce the tasks for `coverage.compute_chunk_metrics` for the given
+    pairs.
+
+    For pairs without a CoverageProgress, the interestingness of the basic
+    blocks is evaluated here and stored together with a new CoverageProgress.
+    The interesting basic blocks after the progress' `last_entry_id` are then
+    split into chunks of COVERAGE_CHUNK_SIZE (with the heuristic, there is a
+    single chunk per pair). Every pair has at least one (possibly empty)
+    chunk, the last one is marked. The CoverageProgress objects are stored in
+    `pair2progress`.
+    """
+    curr_bbset_id = None
+    for bbset, campaign in pairs:
+        if bbset.id != curr_bbset_id:
+            curr_bbset_id = bbset.id
+            all_bbentries = list(bbset.basicblockentry_set.values_list('id', 'asm_str'))
+            num_bbs = len(all_bbentries)
+            measurements = None
+            id2asm_str = None
+
+        progress = CoverageProgress.objects.filter(campaign=campaign, bbset=bbset).first()
+        if progress is None:
+            if measurements is None:
+                measurements = bbset.get_measurements()
+                bb_rows = [ measurements.row_index(entry_id) for entry_id, asm_str in all_bbentries ]
+
+            tool_names = [ t.full_name for t in campaign.tools.all() ]
+
+            interestingness_config = campaign.config_dict.get('interestingness_metric', {})
             interestingness_metric = InterestingnessMetric(interestingness_config)
 
-            interesting_bbs = []
-            for bbidx, bbentry in enumerate(all_bbentries):
-                eval_res = {t.full_name: {
-                            'TP': bbentry.basicblockmeasurement_set.filter(tool=t).get().result
-                        } for t in tools
-                    }
-                is_interesting = interestingness_metric.is_interesting(eval_res)
-                if is_interesting:
-                    # basic blocks are parsed on demand and cached
-                    parsed_bb = parsed_bbs.get(bbidx, None)
-                    if parsed_bb is None:
-                        asm_str = bbentry.asm_str
-                        insns = iwho_ctx.parse_validated_asm(asm_str)
-                        parsed_bb = iwho_ctx.make_bb(insns)
-                        # inject the db object for later reference
-                        parsed_bb.dbobj = bbentry
-                        parsed_bbs[bbidx] = parsed_bb
-
-                    interesting_bbs.append(parsed_bb)
-                    bbentry.interesting_for.add(campaign)
-
-            relevant_discoveries = Discovery.objects.filter(batch__campaign=campaign).filter(subsumed_by=None)
-
-            all_abs = []
-            actx = None
-            for d in relevant_discoveries:
-                absblock = d.absblock
-                ab = load_abstract_block(absblock, actx)
-                if actx is None:
-                    actx = ab.actx
-                # inject the db object for later reference
-                ab.dbobj = d
-                all_abs.append(ab)
-
-            all_abs.sort(key=lambda x: len(x.abs_insns))
-
-            metrics = get_table_metrics(actx=actx, all_abs=all_abs, interesting_bbs=interesting_bbs, total_num_bbs=num_bbs, heuristic=heuristic)
-
-            obj = BasicBlockSetMetrics(bbset=bbset, campaign=campaign, **metrics)
-            obj.save()
+            with phase('interestingness', rows=num_bbs):
+                columns = [ measurements.column(t)[bb_rows] for t in tool_names ]
+                interesting_idxs = np.flatnonzero(is_interesting_bulk(interestingness_metric, tool_names, columns)).tolist()
+
+            interesting_bbs = sorted( all_bbentries[i] for i in interesting_idxs )
+            with phase('write_interesting', rows=len(interesting_bbs)):
+                progress = _start_coverage(campaign.id, bbset.id, [ entry_id for entry_id, asm_str in interesting_bbs ], heuristic)
+        else:
+            if id2asm_str is None:
+                id2asm_str = dict(all_bbentries)
+            remaining_ids = [ entry_id for entry_id in InterestingBasicBlock.entry_ids_for(campaign.id, bbset.id) if entry_id > progress.last_entry_id ]
+            interesting_bbs = [ (entry_id, id2asm_str[entry_id]) for entry_id in remaining_ids ]
+            print(f"resuming (campaign {campaign.id}, bbset {bbset.id}) with {progress.num_done}/{progress.num_interesting} interesting bbs done")
+
+        pair2progress[(campaign.id, bbset.id)] = progress
+
+        # the workers load the discoveries themselves (see coverage.py)
+        discovery_ids = list(Discovery.objects.filter(batch__campaign=campaign).filter(subsumed_by=None).order_by('id').values_list('id', flat=True))
+
+        chunk_size = max(len(interesting_bbs), 1) if heuristic else COVERAGE_CHUNK_SIZE
+        chunk_starts = range(0, max(len(interesting_bbs), 1), chunk_size)
+        for chunk_start in chunk_starts:
+            chunk = interesting_bbs[chunk_start:chunk_start+chunk_size]
+            yield {
+                    'campaign_id': campaign.id,
+                    'bbset_id': bbset.id,
+                    'isa': bbset.isa,
+                    'entry_ids': [ entry_id for entry_id, asm_str in chunk ],
+                    'asm_strs': [ asm_str for entry_id, asm_str in chunk ],
+                    'num_bbs': num_bbs,
+                    'is_last': chunk_start == chunk_starts[-1],
+                    'discovery_ids': discovery_ids,
+                    'heuristic': heuristic,
+                    'verify': verify,
+                }
+
+
+@transaction.atomic
+def _write_coverage_chunk(progress, res):
+    """ Store the coverage results of a chunk and update the progress of its
+    pair. For the last chunk, the metrics of the pair are written and the
+    progress is deleted.
+    """
+    if res['coverage'] is not None:
+        BasicBlockCoverage.objects.bulk_create([
+                BasicBlockCoverage(entry_id=entry_id, discovery_id=discovery_id, bbset_id=progress.bbset_id)
+                for entry_id, discovery_id in res['coverage']
+            ], batch_size=BBSET_CHUNK_SIZE)
+
+    chunk_metrics = res['metrics']
+    if len(res['entry_ids']) > 0:
+        progress.last_entry_id = max(res['entry_ids'])
+        progress.num_done += len(res['entry_ids'])
+        progress.num_covered += chunk_metrics['num_interesting_bbs_covered']
+        progress.num_covered_top10 += chunk_metrics['num_interesting_bbs_covered_top10']
+
+    if not res['is_last']:
+        progress.save()
+        return
+
+    if progress.heuristic:
+        # a single chunk with all interesting blocks
+        metrics = chunk_metrics
+    else:
+        num_bbs = BasicBlockEntry.objects.filter(bbset_id=progress.bbset_id).count()
+        metrics = table_metrics_from_counts(progress.num_interesting, progress.num_covered, progress.num_covered_top10, num_bbs)
+
+    obj = BasicBlockSetMetrics(bbset_id=progress.bbset_id, campaign_id=progress.campaign_id, **metrics)
+    obj.save()
+    progress.delete()
+
+
+def compute_bbset_coverage(campaign_id_seq, bbset_id_seq, heuristic=False, jobs=1, verify=False, force=False):
+    """ Compute metrics on how many basic blocks from the specified BBSets are
+    covered by the specified Campaigns.
+    Both parameters should be sequences of numerical identifiers of
+    corresponding data model objects. Pass empty lists to consider all
+    registered entities.
+
+    The interesting basic blocks of a (campaign, bbset) pair are checked in
+    chunks, the progress is stored after each of them and unfinished pairs
+    are resumed where they stopped. With `force`, existing results of the
+    pairs are deleted and computed anew.
+
+    The chunks are independent of each other. If jobs > 1, they are computed
+    in that many worker processes, while this process writes the results to
+    the database.
+
+    If `verify` is set, the metrics are also computed with AnICA's
+    `get_table_metrics` to check the pruned computation (see coverage.py).
+    """
+    if len(campaign_id_seq) == 0:
+        campaign_id_seq = [ x.id for x in Campaign.objects.all() ]
+
+    if len(bbset_id_seq) == 0:
+        bbset_id_seq = [ x.id for x in BasicBlockSet.objects.all() ]
+
+    pairs = _coverage_pairs(campaign_id_seq, bbset_id_seq, heuristic, force)
+    num_pairs = len(pairs)
+    if num_pairs == 0:
+        return
+
+    print(f"computing coverage metrics for {num_pairs} (campaign, bbset) pairs")
+
+    if jobs > 1:
+        executor = make_worker_pool(jobs)
+    else:
+        executor = None
+
+    pair2progress = dict()
+    # seconds spent on the chunks of each pair, summed over all workers
+    pair2seconds = dict()
+    try:
+        tasks = _coverage_tasks(pairs, heuristic, verify, pair2progress)
+        start = time.perf_counter()
+        num_done = 0
+        # A small window, the tasks can be large and the results are only
+        # waited for in order.
+        results = ordered_map(compute_chunk_metrics, tasks, executor, window=2 * jobs)
+        for res in results:
+            campaign_id = res['campaign_id']
+            bbset_id = res['bbset_id']
+            merge_phases(res['phases'])
+            progress = pair2progress[(campaign_id, bbset_id)]
+            pair2seconds[(campaign_id, bbset_id)] = pair2seconds.get((campaign_id, bbset_id), 0.0) + res['seconds']
+            with phase('write_results', rows=len(res['entry_ids'])):
+                _write_coverage_chunk(progress, res)
+
+            if not res['is_last']:
+                print(f"checked {progress.num_done}/{progress.num_interesting} interesting bbs of (campaign {campaign_id}, bbset {bbset_id}) in {res['seconds']:.1f}s")
+                continue
+
+            del pair2progress[(campaign_id, bbset_id)]
+            pair_seconds = pair2seconds.pop((campaign_id, bbset_id))
+            num_done += 1
+            seconds = time.perf_counter() - start
+            eta = seconds / num_done * (num_pairs - num_done)
+            print(f"computed coverage metrics for (campaign {campaign_id}, bbset {bbset_id})"
+                  f" ({progress.num_interesting} interesting bbs) in {pair_seconds:.1f}s, {num_done}/{num_pairs} pairs done, ETA {eta:.0f}s")
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
 
 def import_generalization(gen_dir):
@@ -498,36 +1139,29 @@ def import_generalization(gen_dir):
     witness_file = str((base_dir / 'witness.json').resolve())
 
     ab_path = base_dir / 'discovery.json'
-    absblock = load_json_config(ab_path)
-    clear_doc_entries(absblock)
-
-    remarks = absblock.get('remarks', None)
-    if remarks is None:
-        remark_text = None
-    else:
-        remark_strs = []
-        for r in remarks:
-            if isinstance(r, str):
-                remark_str = r
-            else:
-                assert isinstance(r, tuple) or isinstance(r, list)
-                remark_str = r[0].format(*r[1:])
-            remark_strs.append("<li>{}</li>".format(remark_str))
-        remark_text = "\n".join(remark_strs)
+    with phase('load_json'):
+        absblock = load_json_config(ab_path)
+        clear_doc_entries(absblock)
 
+    remark_text = make_remark_text(absblock.get('remarks', None))
 
-    ab = load_abstract_block(absblock, actx=None)
+    with phase('load_abstract_block'):
+        ab = load_abstract_block(absblock, actx=None)
     actx = ab.actx
 
+    config = get_abstraction_config(absblock.pop('config'))
+
     generality = math.inf
-    for ai in ab.abs_insns:
-        feasible_schemes = actx.insn_feature_manager.compute_feasible_schemes(ai.features)
-        generality = min(generality, len(feasible_schemes))
+    with phase('feasible_schemes'):
+        for ai in ab.abs_insns:
+            feasible_schemes = feasible_scheme_cache.get_strs(actx, ai.features)
+            generality = min(generality, len(feasible_schemes))
 
     num_insns = len(ab.abs_insns)
 
     generalization = Generalization(
             absblock = absblock,
+            config = config,
             witness_file = witness_file,
             witness_len = witness_len,
             interestingness = None,
@@ -537,20 +1171,8 @@ def import_generalization(gen_dir):
             num_insns = num_insns,
         )
 
-    generalization.save()
-
-    for t in tool_objs:
-        generalization.tools.add(t.id)
-
-
-def clear_doc_entries(json_dict):
-    if isinstance(json_dict, dict):
-        for k in list(json_dict.keys()):
-            if k.endswith('.doc'):
-                del json_dict[k]
-            else:
-                clear_doc_entries(json_dict[k])
-    elif isinstance(json_dict, list) or isinstance(json_dict, tuple):
-        for i in json_dict:
-            clear_doc_entries(i)
+    with phase('write_rows', rows=1):
+        generalization.save()
 
+        for t in tool_objs:
+            generalization.tools.add(t.id)
@@ -1,3 +1,280 @@
 from django.test import TestCase
 
-# Create your tests here.
+from contextlib import contextmanager, redirect_stdout
+import io
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import types
+from unittest import mock
+
+import numpy as np
+
+from . import coverage, interestingness, models
+from .interestingness import is_interesting_bulk, is_interesting_scalar
+from .json_streaming import stream_json_object
+from .models import (BasicBlockCoverage, BasicBlockEntry, BasicBlockMeasurementChunk, BasicBlockSet, BasicBlockSetMetrics,
+        Campaign, CoverageProgress, Discovery, DiscoveryBatch, InterestingBasicBlock, Tool)
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", "tools"))
+import add_metrics
+
+
+class StreamJsonObjectTest(TestCase):
+    doc = ('{"seconds_passed": 12.5, "tiny": 1.5e-3, "big": -2E+10, "n": 1234,\n'
+           ' "flags": [true, false, null], "text": "a \\"quoted\\" \\u00e4 string",\n'
+           ' "per_batch_stats": [{"num_sampled": 10, "batch_time": 0.125},\n'
+           '   {"num_sampled": 7, "batch_time": 3.0e2, "nested": {"x": [1, 2.25, []]}}, 17, "s"],\n'
+           ' "empty": {}, "last": 0.0}')
+
+    def stream_all(self, path, block_size):
+        res = dict()
+        for key, value in stream_json_object(path, 'per_batch_stats', block_size=block_size):
+            if key == 'per_batch_stats':
+                res.setdefault(key, []).append(value)
+            else:
+                res[key] = value
+        return res
+
+    def test_all_block_sizes(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'report.json')
+            with open(path, 'w') as f:
+                f.write(self.doc)
+            with open(path, 'r') as f:
+                expected = json.load(f)
+            for block_size in range(1, len(self.doc) + 1):
+                with self.subTest(block_size=block_size):
+                    self.assertEqual(self.stream_all(path, block_size), expected)
+
+
+def _has_injective_match(small, large, admits):
+    """ Whether each element of `small` can be assigned to a distinct element
+    of `large` that it admits, by trying all assignments.
+    """
+    return any(all(admits(s, l) for s, l in zip(small, perm))
+            for perm in itertools.permutations(large, len(small)))
+
+
+class SchemeIndexTest(TestCase):
+    schemes = [ f"scheme_{i}" for i in range(12) ]
+
+    def random_schemes(self, rng):
+        if rng.random() < 0.15:
+            # more than MAX_INDEXED_SCHEMES, not indexed
+            return frozenset(rng.sample(self.schemes, 6))
+        return frozenset(rng.sample(self.schemes, rng.randint(1, 3)))
+
+    def test_no_match_is_pruned(self):
+        rng = random.Random(42)
+        all_abs = [ types.SimpleNamespace(abs_insns=[ types.SimpleNamespace(features=self.random_schemes(rng)) for _ in range(rng.randint(1, 3)) ])
+                for _ in range(60) ]
+        bbs = [ types.SimpleNamespace(insns=[ types.SimpleNamespace(scheme=rng.choice(self.schemes)) for _ in range(rng.randint(1, 5)) ])
+                for _ in range(300) ]
+
+        scheme_cache = types.SimpleNamespace(get_strs=lambda actx, features: sorted(features))
+        with mock.patch.object(coverage, 'feasible_scheme_cache', scheme_cache), mock.patch.object(coverage, 'MAX_INDEXED_SCHEMES', 5):
+            index = coverage.SchemeIndex(None, all_abs)
+            self.assertTrue(len(index.wildcards) > 0)
+            for bb in bbs:
+                candidates = index.candidates(bb)
+                for ab_idx, ab in enumerate(all_abs):
+                    if _has_injective_match(ab.abs_insns, bb.insns, lambda ai, insn: insn.scheme in ai.features):
+                        self.assertIn(ab_idx, candidates)
+
+
+class SubsumptionIndexTest(TestCase):
+    schemes = [ f"scheme_{i}" for i in range(8) ]
+
+    def random_signature(self, rng):
+        return [ None if rng.random() < 0.1 else frozenset(rng.sample(self.schemes, rng.randint(1, 4)))
+                for _ in range(rng.randint(1, 3)) ]
+
+    @staticmethod
+    def subsumes(signature, other_signature):
+        # the necessary condition of `_may_subsume`, decided by brute force
+        return _has_injective_match(signature, other_signature,
+                lambda schemes, other_schemes: schemes is None or (other_schemes is not None and other_schemes <= schemes))
+
+    def test_may_subsume(self):
+        rng = random.Random(42)
+        signatures = [ self.random_signature(rng) for _ in range(200) ]
+        for signature in signatures:
+            for other_signature in signatures:
+                if self.subsumes(signature, other_signature):
+                    self.assertTrue(add_metrics._may_subsume(signature, other_signature))
+
+    def test_remove_subsumed_by(self):
+        rng = random.Random(23)
+        blocks = [ types.SimpleNamespace(signature=self.random_signature(rng)) for _ in range(200) ]
+
+        def check_subsumed_aa(subsumed, subsuming):
+            return self.subsumes(subsuming.signature, subsumed.signature)
+
+        index = add_metrics.SubsumptionIndex()
+        expected = set()
+        with mock.patch.object(add_metrics, 'check_subsumed_aa', check_subsumed_aa):
+            for idx, block in enumerate(blocks):
+                subsumed = { prev_idx for prev_idx in expected if check_subsumed_aa(blocks[prev_idx], block) }
+                expected -= subsumed
+                self.assertEqual(set(index.remove_subsumed_by(block, block.signature)), subsumed)
+                index.add(idx, block, block.signature)
+                expected.add(idx)
+        self.assertTrue(index.num_avoided > 0)
+
+
+class RelativeDifferenceMetric:
+    """ The relative difference of AnICA's InterestingnessMetric, but only
+    negative and missing results are errors, a result of 0 is not.
+    """
+    def __init__(self, min_interestingness, invert_interestingness=False):
+        self.min_interestingness = min_interestingness
+        self.invert_interestingness = invert_interestingness
+
+    def compute_interestingness(self, eval_res):
+        values = [ r['TP'] for r in eval_res.values() ]
+        if any(v is None or math.isnan(v) or v < 0 for v in values):
+            return math.inf
+        if sum(values) == 0:
+            return 0.0
+        return ((max(values) - min(values)) / sum(values)) * len(values)
+
+    def is_interesting(self, eval_res):
+        res = self.compute_interestingness(eval_res) >= self.min_interestingness
+        return not res if self.invert_interestingness else res
+
+
+class IsInterestingBulkTest(TestCase):
+    tool_names = [ 'tool_a', 'tool_b', 'tool_c' ]
+
+    def random_results(self, rng, num_bbs):
+        results = rng.uniform(0.5, 4.0, size=(num_bbs, len(self.tool_names)))
+        # some blocks with equal results, i.e., an interestingness of 0
+        results[rng.random(num_bbs) < 0.05] = 2.0
+        special = rng.random(results.shape)
+        results[special < 0.03] = np.nan
+        results[(special >= 0.03) & (special < 0.06)] = 0.0
+        results[(special >= 0.06) & (special < 0.09)] = -1.0
+        return results
+
+    def test_matches_scalar(self):
+        rng = np.random.default_rng(42)
+        for min_interestingness in [ 0.0, 0.1, 0.5 ]:
+            for invert in [ False, True ]:
+                with self.subTest(min_interestingness=min_interestingness, invert=invert):
+                    metric = RelativeDifferenceMetric(min_interestingness, invert)
+                    results = self.random_results(rng, 5000)
+                    columns = [ results[:, i].copy() for i in range(len(self.tool_names)) ]
+                    with mock.patch.object(interestingness.logger, 'warning') as warning:
+                        res = is_interesting_bulk(metric, self.tool_names, columns)
+                    # no fallback to the scalar evaluation
+                    warning.assert_not_called()
+                    np.testing.assert_array_equal(res, is_interesting_scalar(metric, self.tool_names, results))
+
+
+class MeasurementMatrixTest(TestCase):
+    def test_chunk_round_trip(self):
+        bbset = BasicBlockSet.objects.create(identifier='bbset', isa='x86', tool_order=[ 'tool_a', 'tool_b', 'tool_c' ])
+        entry_ids = [ BasicBlockEntry.objects.create(bbset=bbset, asm_str='', hex_str='').id for _ in range(25) ]
+        rng = np.random.default_rng(42)
+        results = rng.uniform(0.5, 4.0, size=(len(entry_ids), 3))
+        results[rng.random(results.shape) < 0.1] = np.nan
+        results[0, 1] = -1.0
+        for i in range(0, len(entry_ids), 10):
+            BasicBlockMeasurementChunk.create(bbset, entry_ids[i:i+10], results[i:i+10]).save()
+
+        matrix = bbset.get_measurements()
+        self.assertEqual(matrix.entry_ids.tolist(), entry_ids)
+        np.testing.assert_array_equal(matrix.results, results)
+        np.testing.assert_array_equal(matrix.column('tool_b'), results[:, 1])
+        self.assertEqual(matrix.results_for(entry_ids[0])['tool_b'], -1.0)
+
+        matrix = bbset.get_measurements(entry_ids=[ entry_ids[12] ])
+        self.assertEqual(matrix.entry_ids.tolist(), entry_ids[10:20])
+        np.testing.assert_array_equal(matrix.row(entry_ids[12]), results[12])
+
+
+class CoverageResumeTest(TestCase):
+    def setUp(self):
+        tools = [ Tool.objects.create(full_name=name) for name in [ 'tool_a', 'tool_b' ] ]
+        self.bbset = BasicBlockSet.objects.create(identifier='bbset', isa='x86', tool_order=[ 'tool_a', 'tool_b' ])
+        self.bbset.has_data_for.add(*tools)
+        rng = random.Random(42)
+        entry_ids = [ BasicBlockEntry.objects.create(bbset=self.bbset, asm_str='', hex_str='').id for _ in range(60) ]
+        BasicBlockMeasurementChunk.create(self.bbset, entry_ids, [ [ rng.uniform(1.0, 2.0) for _ in tools ] for _ in entry_ids ]).save()
+
+        for idx in range(2):
+            campaign = Campaign.objects.create(tag='test', config_dict={'interestingness_metric': {'min_interestingness': 0.1 * (idx + 1)}},
+                    config_fingerprint='', termination_condition={}, date='2022-01-01', host_pc='test', total_seconds=0,
+                    restrict_to_supported_insns=False, witness_path='')
+            campaign.tools.add(*tools)
+            batch = DiscoveryBatch.objects.create(campaign=campaign, batch_index=0, num_sampled=1, num_interesting=1, batch_time=0)
+            for i in range(5):
+                Discovery.objects.create(batch=batch, identifier=f'disc_{i}', absblock={}, num_insns=1, witness_len=1, generality=1)
+
+    @staticmethod
+    def compute_chunk_metrics(task):
+        # a discovery covers the entries whose id sums up with its id to a
+        # multiple of 3, the first one is the top discovery
+        coverage = [ (entry_id, discovery_id) for entry_id in task['entry_ids'] for discovery_id in task['discovery_ids']
+                if (entry_id + discovery_id) % 3 == 0 ]
+        return {
+                'campaign_id': task['campaign_id'],
+                'bbset_id': task['bbset_id'],
+                'entry_ids': task['entry_ids'],
+                'is_last': task['is_last'],
+                'metrics': {
+                    'num_interesting_bbs_covered': len({ entry_id for entry_id, discovery_id in coverage }),
+                    'num_interesting_bbs_covered_top10': len({ entry_id for entry_id, discovery_id in coverage if discovery_id == task['discovery_ids'][0] }),
+                },
+                'coverage': coverage,
+                'seconds': 0.0,
+                'phases': {},
+            }
+
+    @contextmanager
+    def patched(self):
+        metric = lambda config: RelativeDifferenceMetric(config['min_interestingness'])
+        with mock.patch.object(models, 'compute_chunk_metrics', self.compute_chunk_metrics), mock.patch.object(models, 'InterestingnessMetric', metric):
+            with mock.patch.object(models, 'COVERAGE_CHUNK_SIZE', 7), redirect_stdout(io.StringIO()):
+                yield
+
+    def results(self):
+        self.assertFalse(CoverageProgress.objects.exists())
+        return (sorted(BasicBlockCoverage.objects.values_list('entry_id', 'discovery_id', 'bbset_id')),
+                sorted(InterestingBasicBlock.objects.values_list('entry_id', 'campaign_id', 'bbset_id')),
+                sorted(BasicBlockSetMetrics.objects.values_list('campaign_id', 'bbset_id', 'num_bbs_interesting',
+                    'num_interesting_bbs_covered', 'num_interesting_bbs_covered_top10')))
+
+    def test_resume_and_force(self):
+        with self.patched():
+            models.compute_bbset_coverage([], [])
+            expected = self.results()
+            self.assertTrue(len(expected[0]) > 0)
+            self.assertEqual(len(expected[2]), 2)
+
+            models.compute_bbset_coverage([], [], force=True)
+            self.assertEqual(self.results(), expected)
+
+            # interrupt a fresh run after some chunks and resume it
+            for campaign in Campaign.objects.all():
+                models._invalidate_coverage(campaign.id, self.bbset.id)
+            write_coverage_chunk = models._write_coverage_chunk
+            num_writes = 0
+            def interrupted_write(progress, res):
+                nonlocal num_writes
+                num_writes += 1
+                if num_writes == 3:
+                    raise KeyboardInterrupt()
+                write_coverage_chunk(progress, res)
+
+            with mock.patch.object(models, '_write_coverage_chunk', interrupted_write), self.assertRaises(KeyboardInterrupt):
+                models.compute_bbset_coverage([], [])
+            self.assertTrue(CoverageProgress.objects.filter(num_done__gt=0).exists())
+
+            models.compute_bbset_coverage([], [])
+            self.assertEqual(self.results(), expected)
@@ -18,10 +18,11 @@ from anica.abstractioncontext import AbstractionContext
 from anica.bbset_coverage import make_heatmap
 from iwho.configurable import config_diff, pretty_print
 
-from .models import Campaign, Discovery, InsnScheme, Generalization, BasicBlockSet, BasicBlockSetMetrics, BasicBlockEntry
-from .custom_pretty_printing import prettify_absblock, prettify_seconds, prettify_config_diff, prettify_abstraction_config, listify
+from .models import Campaign, Discovery, InsnScheme, Generalization, BasicBlockSet, BasicBlockSetMetrics, BasicBlockEntry, InterestingBasicBlock, BasicBlockCoverage
+from .custom_pretty_printing import absblock_html_cache, prettify_absblock, prettify_seconds, prettify_config_diff, prettify_abstraction_config, listify
 from .witness_site import gen_witness_site, gen_measurement_site, get_witnessing_series_id
-from .helpers import load_abstract_block
+from .helpers import load_abstract_block, actx_pool
+from .caching import config_delta_cache
 
 from .plots import *
 
@@ -114,6 +115,10 @@ def all_campaigns_view(request):
         campaigns = Campaign.objects.filter(tag=tag_filter)
         topbarpathlist.append((f"with tag '{tag_filter}'", url_with_querystring(django.urls.reverse('basic_ui:all_campaigns'), tag=tag_filter)))
 
+    # the configs are only needed for computing config deltas that are not
+    # cached yet
+    campaigns = Campaign.with_summary(campaigns.defer('config_dict'))
+
     if len(campaigns) == 0:
         context = {
                 "title": "All Campaigns",
@@ -124,42 +129,37 @@ def all_campaigns_view(request):
 
     assert len(campaigns) > 0
 
-    base_config = AbstractionContext.get_default_config()
-    config_deltas = []
-    for campaign in campaigns:
-        config_deltas.append(config_diff(base_config, campaign.config_dict))
+    def compute_deltas(fingerprints):
+        base_config = AbstractionContext.get_default_config()
+        res = dict()
+        configs = Campaign.objects.filter(config_fingerprint__in=fingerprints).values_list('config_fingerprint', 'config_dict')
+        for fingerprint, config_dict in configs:
+            if fingerprint not in res:
+                res[fingerprint] = config_diff(base_config, config_dict)
+        return res
 
-    common_diffs = []
-    for diff in config_deltas[0]:
-        if all(map(lambda x: diff in x, config_deltas)):
-            common_diffs.append(diff)
+    fingerprint2delta = config_delta_cache.get_many([ c.config_fingerprint for c in campaigns ], compute_deltas)
 
-    for d in common_diffs:
-        for delta in config_deltas:
-            delta.remove(d)
+    # diffs that all campaigns have in common are not shown
+    common_keys = set.intersection(*( set(k for k, d in delta) for delta in fingerprint2delta.values() ))
+    fingerprint2html = { fingerprint: prettify_config_diff([ d for k, d in delta if k not in common_keys ])
+            for fingerprint, delta in fingerprint2delta.items() }
 
     data = []
-    for campaign, delta in zip(campaigns, config_deltas):
-        num_batches = campaign.discoverybatch_set.count()
-        num_discoveries = Discovery.objects.filter(batch__campaign=campaign).filter(subsumed_by=None).count()
-        tool_list = campaign.tools.all()
+    for campaign in campaigns:
         init_interesting_sample_ratio = None
-        if num_batches > 0:
-            init_batch = campaign.discoverybatch_set.order_by('pk').first()
-            if init_batch.num_sampled > 0:
-                init_interesting_sample_ratio = init_batch.num_interesting / init_batch.num_sampled
-
-        config_delta_html = prettify_config_diff(delta)
+        if campaign.num_batches > 0 and campaign.init_num_sampled > 0:
+            init_interesting_sample_ratio = campaign.init_num_interesting / campaign.init_num_sampled
 
         data.append({
             'campaign_id': campaign.id,
             'tag': campaign.tag,
-            'tools': ", ".join(map(str, tool_list)),
-            'config_delta': config_delta_html,
+            'tools': ", ".join(map(str, campaign.tools.all())),
+            'config_delta': fingerprint2html[campaign.config_fingerprint],
             'date': campaign.date,
             'host_pc': campaign.host_pc,
-            'num_batches': num_batches,
-            'num_discoveries': num_discoveries,
+            'num_batches': campaign.num_batches,
+            'num_discoveries': campaign.num_discoveries,
             'init_interesting_sample_ratio': init_interesting_sample_ratio,
             'time_spent': campaign.total_seconds,
             })
@@ -317,6 +317,35 @@ def single_campaign_view(request, campaign_id):
 
     return render(request, 'basic_ui/campaign_overview.html', context)
 
+def render_absblock_cached(obj):
+    """ Render the abstract block of a Discovery or Generalization in a table
+    cell, or take it from the absblock_html_cache. The AbstractionContexts
+    come from the actx_pool, since recreating them for every row would be a
+    lot slower.
+    """
+    def compute():
+        with actx_pool.use(obj.get_config()) as actx:
+            absblock = load_abstract_block(obj.absblock, actx)
+            return prettify_absblock(absblock, skip_top=True)
+
+    return absblock_html_cache.get(obj.get_absblock_fingerprint() + ':compact', compute)
+
+def render_absblock_details(obj):
+    """ Get the HTML for the abstract block of a Discovery or Generalization,
+    for its minimized version, and for its abstraction config, from the
+    absblock_html_cache if possible.
+    """
+    def compute():
+        with actx_pool.use(obj.get_config()) as actx:
+            absblock = load_abstract_block(obj.absblock, actx)
+            absblock_html = prettify_absblock(absblock, add_schemes=True)
+            min_absblock_html = prettify_absblock(absblock.minimize(), add_schemes=True)
+            cfg_str = prettify_abstraction_config(actx.get_config())
+        return (absblock_html, min_absblock_html, cfg_str)
+
+    return absblock_html_cache.get(obj.get_absblock_fingerprint() + ':details', compute)
+
+
 discovery_table_attrs = {"class": "discoverytable"}
 
 class DiscoveryTable(tables.Table):
@@ -345,14 +374,8 @@ class DiscoveryTable(tables.Table):
         row_attrs = discovery_table_attrs
         attrs = discovery_table_attrs
 
-    def render_absblock(self, value):
-        # TODO storing the AbstractionContext here is somewhat ugly, but it is
-        # a lot faster than recreating it every time.
-        actx = getattr(self, '_actx', None)
-        res = load_abstract_block(value, actx)
-        if actx is None:
-            self._actx = res.actx
-        return prettify_absblock(res, skip_top=True)
+    def render_absblock(self, value, record):
+        return render_absblock_cached(record)
 
     def render_interestingness(self, value):
         return "{:.2f}".format(value)
@@ -362,7 +385,7 @@ def all_discoveries_view(request, campaign_id):
     show_subsumed = request.GET.get('show_subsumed', '0')
     show_subsumed = (show_subsumed != '0')
 
-    objs = Discovery.objects.filter(batch__campaign_id=campaign_id)
+    objs = Discovery.objects.filter(batch__campaign_id=campaign_id).select_related('config')
     if not show_subsumed:
         objs = objs.filter(subsumed_by=None)
 
@@ -387,17 +410,13 @@ def all_discoveries_view(request, campaign_id):
 
 def discovery_json_view(request, campaign_id, discovery_id):
     discovery_obj = get_object_or_404(Discovery, batch__campaign_id=campaign_id, identifier=discovery_id)
-    json_content = pretty_print(discovery_obj.absblock)
+    json_content = pretty_print(discovery_obj.get_absblock_json())
     return HttpResponse(json_content, content_type="text/plain")
 
 def single_discovery_view(request, campaign_id, discovery_id):
-    discovery_obj = get_object_or_404(Discovery, batch__campaign_id=campaign_id, identifier=discovery_id)
-
-    absblock = load_abstract_block(discovery_obj.absblock, None)
+    discovery_obj = get_object_or_404(Discovery.objects.select_related('config'), batch__campaign_id=campaign_id, identifier=discovery_id)
 
-    absblock_html = prettify_absblock(absblock, add_schemes=True)
-
-    min_absblock_html = prettify_absblock(absblock.minimize(), add_schemes=True)
+    absblock_html, min_absblock_html, _ = render_absblock_details(discovery_obj)
 
     mean_interestingness = discovery_obj.interestingness
     witness_length = discovery_obj.witness_len
@@ -417,6 +436,12 @@ def single_discovery_view(request, campaign_id, discovery_id):
     if subsumed_by is not None:
         stats.append(('subsumed by', subsumed_by))
 
+    covered_per_bbset = BasicBlockCoverage.objects.filter(discovery=discovery_obj).values('bbset_id', 'bbset__identifier').annotate(num_covered=Count('id')).order_by('bbset_id')
+    for entry in covered_per_bbset:
+        url = url_with_querystring(django.urls.reverse('basic_ui:single_bbset_allbbs', kwargs={'bbset_id': entry['bbset_id']}), covered_by=discovery_obj.id)
+        link = mark_safe("<a href=\"{}\">{}</a>".format(url, entry['num_covered']))
+        stats.append((f"interesting basic blocks covered in '{entry['bbset__identifier']}'", link))
+
     plots = [
             make_interestingness_histogramm_plot(list(discovery_obj.measurement_set.all())),
         ]
@@ -428,7 +453,7 @@ def single_discovery_view(request, campaign_id, discovery_id):
         example_series_id = get_witnessing_series_id(path)
 
     input_id = discovery_obj.identifier.rsplit('_', 1)[0]
-    related_generalizations = Discovery.objects.filter(batch__campaign_id=campaign_id, identifier__startswith=input_id).exclude(identifier=discovery_obj.identifier)
+    related_generalizations = Discovery.objects.filter(batch__campaign_id=campaign_id, identifier__startswith=input_id).exclude(identifier=discovery_obj.identifier).select_related('config')
     table = DiscoveryTable(related_generalizations)
 
     topbarpathlist = [
@@ -538,7 +563,7 @@ def single_insnscheme_view(request, campaign_id, ischeme_id):
     else:
         discoveries = ischeme_obj.discovery_set.filter(batch__campaign_id=campaign_id, subsumed_by=None)
 
-    table = DiscoveryTable(discoveries)
+    table = DiscoveryTable(discoveries.select_related('config'))
 
     tables.RequestConfig(request).configure(table)
 
@@ -586,11 +611,8 @@ class GeneralizationTable(tables.Table):
             attrs={"td": gen_table_attrs, "th": gen_table_attrs},
             verbose_name="Witness Length")
 
-    def render_absblock(self, value):
-        # We cannot use the hack of storing the actx here, since
-        # generalizations may have entirely different configs!
-        res = load_abstract_block(value, None)
-        return prettify_absblock(res, skip_top=True)
+    def render_absblock(self, value, record):
+        return render_absblock_cached(record['obj'])
 
     def render_interestingness(self, value):
         return "{:.2f}".format(value)
@@ -605,7 +627,7 @@ def all_generalizations_view(request):
             ('individual generalizations', django.urls.reverse('basic_ui:all_generalizations')),
         ]
 
-    generalizations = Generalization.objects.all()
+    generalizations = Generalization.objects.select_related('config')
 
     if len(generalizations) == 0:
         context = {
@@ -622,6 +644,7 @@ def all_generalizations_view(request):
         tool_list = generalization.tools.all()
 
         data.append({
+            'obj': generalization,
             'generalization_id': generalization.id,
             'tools': ", ".join(map(str, tool_list)),
             'absblock': generalization.absblock,
@@ -648,19 +671,13 @@ def all_generalizations_view(request):
 
 def generalization_json_view(request, generalization_id):
     gen_obj = get_object_or_404(Generalization, id=generalization_id)
-    json_content = pretty_print(gen_obj.absblock)
+    json_content = pretty_print(gen_obj.get_absblock_json())
     return HttpResponse(json_content, content_type="text/plain")
 
 def single_generalization_view(request, generalization_id):
-    gen_obj = get_object_or_404(Generalization, id=generalization_id)
+    gen_obj = get_object_or_404(Generalization.objects.select_related('config'), id=generalization_id)
 
-    absblock = load_abstract_block(gen_obj.absblock, None)
-
-    absblock_html = prettify_absblock(absblock, add_schemes=True)
-
-    cfg_str = prettify_abstraction_config(absblock.actx.get_config())
-
-    min_absblock_html = prettify_absblock(absblock.minimize(), add_schemes=True)
+    absblock_html, min_absblock_html, cfg_str = render_absblock_details(gen_obj)
 
     # mean_interestingness = gen_obj.interestingness
     witness_length = gen_obj.witness_len
@@ -712,11 +729,8 @@ def single_generalization_view(request, generalization_id):
 def gen_measurements_view(request, generalization_id, meas_id):
     gen_obj = get_object_or_404(Generalization, pk=generalization_id)
 
-    config = gen_obj.absblock.get('config', {})
-    config['predmanager'] = None
-    actx = AbstractionContext(config)
-
-    context = gen_measurement_site(actx, meas_id)
+    with actx_pool.use(gen_obj.get_config()) as actx:
+        context = gen_measurement_site(actx, meas_id)
 
     if context is None:
         raise Http404(f"Measurements could not be found.")
@@ -762,11 +776,8 @@ def gen_witness_view(request, generalization_id):
 def gen_measurements_overview_view(request, generalization_id, meas_id):
     gen_obj = get_object_or_404(Generalization, pk=generalization_id)
 
-    config = gen_obj.absblock.get('config', {})
-    config['predmanager'] = None
-    actx = AbstractionContext(config)
-
-    context = gen_measurement_site(actx, meas_id, 3)
+    with actx_pool.use(gen_obj.get_config()) as actx:
+        context = gen_measurement_site(actx, meas_id, 3)
 
     if context is None:
         raise Http404(f"Measurements could not be found.")
@@ -816,11 +827,8 @@ def measurements_view(request, campaign_id, meas_id):
     campaign_obj = get_object_or_404(Campaign, pk=campaign_id)
 
 
-    config = campaign_obj.config_dict
-    config['predmanager'] = None
-    actx = AbstractionContext(config)
-
-    context = gen_measurement_site(actx, meas_id)
+    with actx_pool.use(campaign_obj.config_dict) as actx:
+        context = gen_measurement_site(actx, meas_id)
 
     if context is None:
         raise Http404(f"Measurements could not be found.")
@@ -832,11 +840,8 @@ def measurements_overview_view(request, campaign_id, meas_id):
     campaign_obj = get_object_or_404(Campaign, pk=campaign_id)
 
 
-    config = campaign_obj.config_dict
-    config['predmanager'] = None
-    actx = AbstractionContext(config)
-
-    context = gen_measurement_site(actx, meas_id, 3)
+    with actx_pool.use(campaign_obj.config_dict) as actx:
+        context = gen_measurement_site(actx, meas_id, 3)
 
     if context is None:
         raise Http404(f"Measurements could not be found.")
@@ -872,7 +877,7 @@ def all_bbsets_view(request):
         tool_str = listify(bbset.has_data_for.all())
         data.append({
             'bbset_id': bbset.id,
-            'identifier': bbset.identifier,
+            'identifier': bbset.identifier if bbset.import_finished else f"{bbset.identifier} (import incomplete)",
             'tools': tool_str,
             'num_bbs': bbset.basicblockentry_set.count(),
         })
@@ -914,7 +919,9 @@ class SingleBBSetTable(tables.Table):
     bbset_size = tables.Column(attrs={"td": campaign_table_attrs, "th": campaign_table_attrs}, visible=False)
     bbset_id = tables.Column(attrs={"td": campaign_table_attrs, "th": campaign_table_attrs}, visible=False)
 
-    num_interesting = tables.Column(attrs={"td": campaign_table_attrs, "th": campaign_table_attrs},
+    num_interesting = tables.Column(
+            linkify=(lambda record: url_with_querystring(django.urls.reverse('basic_ui:single_bbset_allbbs', kwargs={'bbset_id': record['bbset_id']}), interesting_for=record['campaign_id'])),
+            attrs={"td": campaign_table_attrs, "th": campaign_table_attrs},
             verbose_name="# BBs interesting")
     num_interesting_covered = tables.Column(attrs={"td": campaign_table_attrs, "th": campaign_table_attrs},
             visible=False)
@@ -995,11 +1002,12 @@ def single_bbset_view(request, bbset_id):
     tables.RequestConfig(request, paginate=False).configure(table)
 
 
-    tool_keys = [ str(t) for t in bbset_obj.has_data_for.all()]
+    measurements = bbset_obj.get_measurements()
+    tool_keys = measurements.tools
 
     plot_data = []
-    for entry in bbset_obj.basicblockentry_set.all():
-        d = {'bb': entry.hex_str, **entry.measurement_results}
+    for entry_id, hex_str in bbset_obj.basicblockentry_set.values_list('id', 'hex_str'):
+        d = {'bb': hex_str, **measurements.results_for(entry_id)}
         plot_data.append(d)
 
     threshold = 0.5
@@ -1030,15 +1038,47 @@ class EntireBBSetTable(tables.Table):
             verbose_name="Basic Block (ASM)", orderable=False)
     measurement_results = tables.Column(
             attrs={"td": discovery_table_attrs, "th": discovery_table_attrs},
-            verbose_name="Predictor Results", orderable=False)
-
-    def render_measurement_results(self, value):
+            verbose_name="Predictor Results", orderable=False, empty_values=())
+    covered_by = tables.Column(
+            attrs={"td": discovery_table_attrs, "th": discovery_table_attrs},
+            verbose_name="Covered by", orderable=False, empty_values=())
+
+    def __init__(self, bbset, entries=None, *args, **kwargs):
+        if entries is None:
+            entries = bbset.basicblockentry_set.all()
+        super().__init__(entries, *args, **kwargs)
+        self.bbset = bbset
+        self._measurements = None
+        self._covering_discoveries = None
+
+    def _page_entry_ids(self):
+        page = getattr(self, 'page', None)
+        if page is None:
+            return None
+        return [ r.record.id for r in page.object_list ]
+
+    def render_measurement_results(self, record):
+        if self._measurements is None:
+            # only load the chunks of the measurement matrix for the current page
+            self._measurements = self.bbset.get_measurements(self._page_entry_ids())
         lines = []
-        for tool, res in value.items():
+        for tool, res in self._measurements.results_for(record.id).items():
             lines.append("  {}: {:.2f}".format(tool, res))
         lines.sort()
         return listify(lines)
 
+    def render_covered_by(self, record):
+        if self._covering_discoveries is None:
+            entry_ids = self._page_entry_ids()
+            if entry_ids is None:
+                entry_ids = [ e.id for e in self.data ]
+            self._covering_discoveries = BasicBlockCoverage.discoveries_covering(entry_ids)
+        links = []
+        for campaign_id, identifier in self._covering_discoveries.get(record.id, []):
+            url = django.urls.reverse('basic_ui:single_discovery', kwargs={'campaign_id': campaign_id, 'discovery_id': identifier})
+            links.append("<a href=\"{}\">{} (campaign {})</a>".format(url, escape(identifier), campaign_id))
+        return listify(links)
+
     def render_asm_str(self, value):
         return mark_safe("<pre class=\"asmblock\">" + escape(value) + "</pre>")
 
@@ -1059,7 +1099,18 @@ def single_bbset_allbbs_view(request, bbset_id):
             ('all basic blocks', django.urls.reverse('basic_ui:single_bbset_allbbs', kwargs={'bbset_id': bbset_id}) )
         ]
 
-    table = EntireBBSetTable(bbset_obj.basicblockentry_set.all())
+    interesting_for = request.GET.get('interesting_for', None)
+    covered_by = request.GET.get('covered_by', None)
+    if covered_by is not None:
+        discovery_obj = get_object_or_404(Discovery, pk=covered_by)
+        topbarpathlist.append((f'covered by discovery {discovery_obj.identifier}', url_with_querystring(django.urls.reverse('basic_ui:single_bbset_allbbs', kwargs={'bbset_id': bbset_id}), covered_by=discovery_obj.id)))
+        table = EntireBBSetTable(bbset_obj, BasicBlockCoverage.entries_covered_by(discovery_obj.id, bbset_obj.id))
+    elif interesting_for is None:
+        table = EntireBBSetTable(bbset_obj)
+    else:
+        campaign_obj = get_object_or_404(Campaign, pk=interesting_for)
+        topbarpathlist.append((f'interesting for campaign {campaign_obj.id}', url_with_querystring(django.urls.reverse('basic_ui:single_bbset_allbbs', kwargs={'bbset_id': bbset_id}), interesting_for=campaign_obj.id)))
+        table = EntireBBSetTable(bbset_obj, InterestingBasicBlock.entries_for(campaign_obj.id, bbset_obj.id))
     tables.RequestConfig(request).configure(table)
 
     context = {
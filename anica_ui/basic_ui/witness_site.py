@@ -2,18 +2,25 @@ import django
 
 from copy import deepcopy
 import json
+import os
+import sys
 import textwrap
 
-from anica.abstractioncontext import AbstractionContext
 from anica.witness import WitnessTrace
 from iwho.configurable import load_json_config
 
 from .custom_pretty_printing import prettify_absblock
+from .helpers import actx_pool
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", "tools"))
+from series_access import get_many_series
 
 def gen_witness_site(witness_path, mk_meas_link):
-    tr = load_witness(witness_path)
-    g =  make_witness_graph(tr, mk_meas_link)
-    return g.generate()
+    json_dict = load_json_config(witness_path)
+    with actx_pool.use(json_dict['config']) as actx:
+        tr = load_witness(json_dict, actx)
+        g =  make_witness_graph(tr, mk_meas_link)
+        return g.generate()
 
 
 def get_witnessing_series_id(witness_path):
@@ -22,22 +29,20 @@ def get_witnessing_series_id(witness_path):
     """
     res_id = -1
 
-    tr = load_witness(witness_path)
-    for witness, ab in tr.iter(taken_only=True):
-        if witness.measurements is not None:
-            res_id = witness.measurements
+    json_dict = load_json_config(witness_path)
+    with actx_pool.use(json_dict['config']) as actx:
+        tr = load_witness(json_dict, actx)
+        for witness, ab in tr.iter(taken_only=True):
+            if witness.measurements is not None:
+                res_id = witness.measurements
 
     return res_id
 
 
-def load_witness(trfile, actx=None):
-    json_dict = load_json_config(trfile)
-
-    if actx is None:
-        config_dict = json_dict['config']
-        config_dict['predmanager'] = None # we don't need that one here
-        actx = AbstractionContext(config=config_dict)
-
+def load_witness(json_dict, actx):
+    """ Create a WitnessTrace from the json dict of a witness file, with the
+    AbstractionContext for its config.
+    """
     tr_dict = actx.json_ref_manager.resolve_json_references(json_dict['trace'])
 
     tr = WitnessTrace.from_json_dict(actx, tr_dict)
@@ -193,10 +198,13 @@ def gen_measurement_site(actx, series_id, choose_only=None):
     the given series in a way that attempts to capture diverse interestingness
     values and display them like a normal measurement site. Otherwise: show
     all.
+
+    For a context from the actx_pool, the caller needs to hold its lock (see
+    `ActxPool.use`).
     """
 
     with actx.measurement_db as mdb:
-        measdict = mdb.get_series(series_id)
+        measdict = get_many_series(mdb, [series_id])[series_id]
 
     if measdict is None:
         return None
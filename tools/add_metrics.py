@@ -4,12 +4,16 @@ campaign directories.
 """
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import itertools
 import json
 import math
 import os
 from pathlib import Path
 import random
 from statistics import geometric_mean
+import sys
 
 from progress.bar import Bar as ProgressBar
 
@@ -21,13 +25,23 @@ from anica.satsumption import check_subsumed_aa
 
 from anica.utils import Timer
 
+from series_access import get_many_series
+
+# The feasible schemes are taken from the cache of the UI, which is shared
+# with the imports via its disk cache. It only needs the django settings.
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "anica_ui"))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'anica_ui.settings')
+from basic_ui.caching import feasible_scheme_cache
+
+def _make_actx(config_dict):
+    config_dict['predmanager'] = None # we don't need that one here
+    return AbstractionContext(config=config_dict)
+
 def load_absblock(abfile, actx=None):
     json_dict = load_json_config(abfile)
 
     if actx is None:
-        config_dict = json_dict['config']
-        config_dict['predmanager'] = None # we don't need that one here
-        actx = AbstractionContext(config=config_dict)
+        actx = _make_actx(json_dict['config'])
 
     result_ref = json_dict['result_ref']
 
@@ -36,72 +50,278 @@ def load_absblock(abfile, actx=None):
     ab = AbstractBlock.from_json_dict(actx, ab_dict)
     return ab, result_ref
 
-def add_metrics_for_campaign_dir(campaign_dir, overwrite=False):
+
+# Every process keeps the abstraction context (with an open measurement db
+# connection) for the campaign directory it worked on most recently.
+_last_actx = (None, None)
+
+def _get_actx(base_dir, abfile):
+    global _last_actx
+    key, actx = _last_actx
+    if key != base_dir:
+        _release_actx()
+        actx = _make_actx(load_json_config(abfile)['config'])
+        actx.measurement_db._init_con()
+        _last_actx = (base_dir, actx)
+    return actx
+
+def _release_actx():
+    global _last_actx
+    key, actx = _last_actx
+    if actx is not None:
+        actx.measurement_db._deinit_con()
+    _last_actx = (None, None)
+
+
+# Abstract instructions that admit more schemes than this get no scheme set in
+# their signature, they are assumed to admit every scheme.
+MAX_SIGNATURE_SCHEMES = 1024
+
+def _scheme_signature(actx, abs_insn):
+    """ The strings of the schemes that are feasible for the abstract
+    instruction, as a frozenset, or None if there are too many of them.
+    The schemes come from the feasible_scheme_cache, the sets are memoized
+    per abstraction context by the feature values.
+    """
+    memo = getattr(actx, 'scheme_signature_memo', None)
+    if memo is None:
+        memo = dict()
+        actx.scheme_signature_memo = memo
+
+    key = json.dumps({k: v.to_json_dict() for k, v in abs_insn.features.items()}, sort_keys=True)
+    res = memo.get(key, False)
+    if res is False:
+        res = frozenset(feasible_scheme_cache.get_strs(actx, abs_insn.features))
+        if len(res) > MAX_SIGNATURE_SCHEMES:
+            res = None
+        memo[key] = res
+    return res
+
+
+def _may_subsume(signature, other_signature):
+    """ A necessary condition for the abstract block with the first signature
+    to subsume the one with the second: each of its abstract instructions
+    admits all schemes of an abstract instruction of the other block, and
+    there are at least as many such instructions in the other block as it has
+    abstract instructions.
+    """
+    if len(signature) > len(other_signature):
+        return False
+    matched = set()
+    for schemes in signature:
+        found = False
+        for idx, other_schemes in enumerate(other_signature):
+            if schemes is None or (other_schemes is not None and other_schemes <= schemes):
+                matched.add(idx)
+                found = True
+        if not found:
+            return False
+    return len(matched) >= len(signature)
+
+
+class SubsumptionIndex:
+    """ The discoveries of a campaign that are not (yet) subsumed by a later
+    one, grouped by their number of abstract instructions, with a signature
+    of the feasible schemes of each abstract instruction. Only those that can
+    be subsumed by a new discovery according to the signatures are checked
+    with `check_subsumed_aa`.
+    """
+    def __init__(self):
+        # number of abstract insns -> discovery id -> (abstract block, signature)
+        self.by_num_insns = dict()
+        self.num_checks = 0
+        self.num_avoided = 0
+
+    def add(self, discovery_id, absblock, signature):
+        self.by_num_insns.setdefault(len(signature), dict())[discovery_id] = (absblock, signature)
+
+    def remove_subsumed_by(self, absblock, signature):
+        """ Remove the discoveries that are subsumed by the given abstract
+        block from the index and return their ids.
+        """
+        res = []
+        for num_insns, entries in self.by_num_insns.items():
+            if num_insns < len(signature):
+                self.num_avoided += len(entries)
+                continue
+            subsumed = []
+            for prev_id, (prev_ab, prev_signature) in entries.items():
+                if not _may_subsume(signature, prev_signature):
+                    self.num_avoided += 1
+                    continue
+                self.num_checks += 1
+                if check_subsumed_aa(prev_ab, absblock):
+                    subsumed.append(prev_id)
+            for prev_id in subsumed:
+                del entries[prev_id]
+            res += subsumed
+        return res
+
+
+# number of discoveries whose measurement series are fetched together
+SERIES_BATCH_SIZE = 256
+
+def compute_discovery_metrics(base_dir, abfiles):
+    """ Load the discoveries from the given files and compute the
+    interestingness of their measurements. This does not depend on the other
+    discoveries, so it can run in a worker process. The measurement series
+    of all discoveries are fetched together (see series_access.py).
+
+    Returns, for each discovery, the abstract block, its signature for the
+    SubsumptionIndex, the interestingness series and its geometric mean.
+    """
+    actx = _get_actx(base_dir, abfiles[0])
+    loaded = [ load_absblock(abfile, actx=actx) for abfile in abfiles ]
+
+    with Timer.Sub('get_series'):
+        series = get_many_series(actx.measurement_db, [ result_ref for absblock, result_ref in loaded ])
+
+    res = []
+    for absblock, result_ref in loaded:
+        meas_series = series[result_ref]
+
+        with Timer.Sub('compute_interestingness'):
+            # get interestingness
+            ints = []
+            for entry in meas_series['measurements']:
+                eval_res = dict()
+                for r in entry['predictor_runs']:
+                    eval_res[r['predictor']] = {'TP': r['result']}
+                interestingness = actx.interestingness_metric.compute_interestingness(eval_res)
+                ints.append(interestingness)
+
+        if len(ints) == 0 or any(map(lambda x: not math.isfinite(x), ints)) or any(map(lambda x: x <= 0, ints)):
+            mean_interestingness = math.inf
+        else:
+            mean_interestingness = geometric_mean(ints)
+
+        signature = [ _scheme_signature(actx, ai) for ai in absblock.abs_insns ]
+
+        res.append((absblock, signature, ints, mean_interestingness))
+    return res
+
+def load_discovery_signatures(base_dir, abfiles):
+    """ Load the discoveries from the given files for the SubsumptionIndex,
+    without computing their metrics.
+
+    Returns, for each discovery, the abstract block and its signature, like
+    `compute_discovery_metrics`.
+    """
+    actx = _get_actx(base_dir, abfiles[0])
+    res = []
+    for abfile in abfiles:
+        absblock, result_ref = load_absblock(abfile, actx=actx)
+        signature = [ _scheme_signature(actx, ai) for ai in absblock.abs_insns ]
+        res.append((absblock, signature))
+    return res
+
+def _absblocks_to_json(fun, base_dir, abfiles):
+    """ Apply the worker function and replace the abstract blocks in its
+    results by their json dicts, to send them to another process.
+    New feasible scheme cache entries are flushed, since worker processes do
+    not run exit handlers.
+    """
+    res = [ (absblock.to_json_dict(), *rest) for absblock, *rest in fun(base_dir, abfiles) ]
+    feasible_scheme_cache.flush()
+    return res
+
+def _map_batches(fun, base_dir, paths, executor):
+    """ Apply the worker function to batches of the given discovery files
+    and chain the per-discovery results in order.
+
+    Without an executor, the loaded abstract blocks are used as they are.
+    Otherwise, they are sent to this process as json dicts and loaded again
+    with the abstraction context of this process.
+    """
+    if len(paths) == 0:
+        return iter(())
+    batch_size = SERIES_BATCH_SIZE
+    if executor is None:
+        batches = [ paths[i:i+batch_size] for i in range(0, len(paths), batch_size) ]
+        return itertools.chain.from_iterable(map(partial(fun, base_dir), batches))
+
+    # enough batches to keep all workers busy
+    batch_size = max(1, min(batch_size, len(paths) // 64))
+    batches = [ paths[i:i+batch_size] for i in range(0, len(paths), batch_size) ]
+    results = executor.map(partial(_absblocks_to_json, fun, base_dir), batches)
+    actx = _get_actx(base_dir, paths[0])
+    return ( (AbstractBlock.from_json_dict(actx, ab_dict), *rest) for ab_dict, *rest in itertools.chain.from_iterable(results) )
+
+def _store_metrics(discovery2metrics, result_path):
+    """ Write the metrics file via a temporary file, so that it is never left
+    incomplete.
+    """
+    tmp_path = result_path.with_name(result_path.name + '.tmp')
+    store_json_config(discovery2metrics, tmp_path)
+    os.replace(tmp_path, result_path)
+
+def add_metrics_for_campaign_dir(campaign_dir, overwrite=False, executor=None, incremental=False):
+    """ Compute the metrics for the discoveries in the campaign directory.
+
+    If an executor (e.g., a ProcessPoolExecutor) is given, the discoveries
+    are loaded and their interestingness is computed with it. Only the
+    subsumption checks between discoveries run in this process, in the order
+    of the discovery files.
+
+    With `incremental`, the metrics in an existing metrics.json are kept and
+    only the discoveries that are not listed there are processed. They are
+    checked for subsumption against the unsubsumed discoveries from the file.
+    """
     base_dir = Path(campaign_dir)
 
     result_path = base_dir / 'metrics.json'
 
-    if result_path.exists() and not overwrite:
-        print(f"Adding no metrics to campaign directory '{base_dir}' because a 'metrics.json' already exists. Run with '--overwrite' to overwrite.")
+    if result_path.exists() and not overwrite and not incremental:
+        print(f"Adding no metrics to campaign directory '{base_dir}' because a 'metrics.json' already exists. Run with '--overwrite' to overwrite or with '--incremental' to add new discoveries.")
         return
 
-    print(f"computing metrics for '{base_dir}'")
-
     discovery2metrics = dict()
+    if incremental and result_path.exists() and not overwrite:
+        with open(result_path, 'r') as f:
+            discovery2metrics = json.load(f)
+
+    unsubsumed = SubsumptionIndex()
+
+    discovery_ids = []
+    discovery_paths = []
+    for fn in os.listdir(base_dir / 'discoveries'):
+        discovery_id, ext = os.path.splitext(fn)
+        assert ext == '.json'
+        if discovery_id in discovery2metrics:
+            continue
+        discovery_ids.append(discovery_id)
+        discovery_paths.append(base_dir / 'discoveries' / f'{discovery_id}.json')
+
+    if len(discovery2metrics) > 0:
+        if len(discovery_ids) == 0:
+            print(f"Adding no metrics to campaign directory '{base_dir}' because there are no new discoveries.")
+            return
+        print(f"computing metrics for {len(discovery_ids)} new discoveries in '{base_dir}'")
+
+        prev_ids = [ discovery_id for discovery_id, metrics in discovery2metrics.items() if metrics['subsumed_by'] is None ]
+        prev_paths = [ base_dir / 'discoveries' / f'{discovery_id}.json' for discovery_id in prev_ids ]
+        with Timer.Sub('load_unsubsumed'):
+            for prev_id, (absblock, signature) in zip(prev_ids, _map_batches(load_discovery_signatures, base_dir, prev_paths, executor)):
+                unsubsumed.add(prev_id, absblock, signature)
+    else:
+        print(f"computing metrics for '{base_dir}'")
+
+    results = _map_batches(compute_discovery_metrics, base_dir, discovery_paths, executor)
 
-    unsubsumed_absblocks = []
-
-    actx = None
-    mdb = None
-
-    discovery_files = list(os.listdir(base_dir / 'discoveries'))
     with ProgressBar(f"progress:",
             suffix = '%(percent).1f%%',
-            max=len(discovery_files)) as pb:
-        for fn in discovery_files:
-            discovery_id, ext = os.path.splitext(fn)
-            assert ext == '.json'
-            full_path = base_dir / 'discoveries' / f'{discovery_id}.json'
-
-            absblock, result_ref = load_absblock(full_path, actx=actx)
-            if actx is None:
-                actx = absblock.actx
-                mdb = actx.measurement_db
-                mdb._init_con()
-
-            with Timer.Sub('get_series'):
-                # with actx.measurement_db as mdb:
-                meas_series = mdb.get_series(result_ref)
-
-            with Timer.Sub('compute_interestingness'):
-                # get interestingness
-                ints = []
-                for entry in meas_series['measurements']:
-                    eval_res = dict()
-                    for r in entry['predictor_runs']:
-                        eval_res[r['predictor']] = {'TP': r['result']}
-                    interestingness = actx.interestingness_metric.compute_interestingness(eval_res)
-                    ints.append(interestingness)
-
-            if len(ints) == 0 or any(map(lambda x: not math.isfinite(x), ints)) or any(map(lambda x: x <= 0, ints)):
-                mean_interestingness = math.inf
-            else:
-                mean_interestingness = geometric_mean(ints)
+            max=len(discovery_paths)) as pb:
+        for discovery_id, (absblock, signature, ints, mean_interestingness) in zip(discovery_ids, results):
 
             with Timer.Sub('subsumption_check'):
                 # check if this discovery subsumes any of the previous ones
                 # The other direction should not be possible, because such
                 # cases should be prevented by the subsumption check in the
                 # discovery algorithm.
-                next_unsubsumed_absblocks = []
-                for prev_id, prev_ab in unsubsumed_absblocks:
-                    if check_subsumed_aa(prev_ab, absblock):
-                        discovery2metrics[prev_id]['subsumed_by'] = discovery_id
-                        continue
-                    next_unsubsumed_absblocks.append((prev_id, prev_ab))
-                unsubsumed_absblocks = next_unsubsumed_absblocks
+                for prev_id in unsubsumed.remove_subsumed_by(absblock, signature):
+                    discovery2metrics[prev_id]['subsumed_by'] = discovery_id
 
-                unsubsumed_absblocks.append((discovery_id, absblock))
+                unsubsumed.add(discovery_id, absblock, signature)
 
             metrics = {
                     'mean_interestingness' : mean_interestingness,
@@ -112,16 +332,19 @@ def add_metrics_for_campaign_dir(campaign_dir, overwrite=False):
             discovery2metrics[discovery_id] = metrics
             pb.next()
 
-    if mdb is not None:
-        mdb._deinit_con()
-    store_json_config(discovery2metrics, result_path)
+    print(f"subsumption checks: {unsubsumed.num_checks} performed, {unsubsumed.num_avoided} avoided by the index")
+
+    _release_actx()
+    _store_metrics(discovery2metrics, result_path)
 
 
 def main():
     ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
     ap.add_argument('-s', '--seed', type=int, default=424242, metavar="SEED", help="Seed for the random number generator.")
+    ap.add_argument('-j', '--jobs', type=int, default=1, metavar="N", help="number of worker processes for loading discoveries and computing their interestingness")
     ap.add_argument('--overwrite', action='store_true', help="if specified, overwrite existing 'metrics.json' files with newly computed data")
+    ap.add_argument('--incremental', action='store_true', help="if specified, add the metrics of discoveries that are not yet in existing 'metrics.json' files")
 
     # ap.add_argument('--covnum', type=int, default=10000, help="number of samples to use for computing absblock coverage")
     ap.add_argument('campaigndirs', metavar='DIR', nargs='+', help='path(s) to a campaign result directory')
@@ -132,9 +355,14 @@ def main():
 
     random.seed(args.seed)
 
-    with Timer('total') as timer:
-        for campaign_dir in args.campaigndirs:
-            add_metrics_for_campaign_dir(campaign_dir, overwrite=args.overwrite)
+    executor = ProcessPoolExecutor(max_workers=args.jobs) if args.jobs > 1 else None
+    try:
+        with Timer('total') as timer:
+            for campaign_dir in args.campaigndirs:
+                add_metrics_for_campaign_dir(campaign_dir, overwrite=args.overwrite, executor=executor, incremental=args.incremental)
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
     print(timer.get_result())
 
@@ -35,7 +35,7 @@ repo_base = Path(__file__).parent.parent
 add_metrics_command =  repo_base / 'tools' / 'add_metrics.py'
 import_command =  repo_base / 'anica_ui' / 'manage.py'
 
-def handle_location(location, target_dir, add_metrics=False, import_name=None):
+def handle_location(location, target_dir, add_metrics=False, import_name=None, jobs=1):
 
     run_fun = dry_run_fun
     run_fun = subprocess.run
@@ -90,7 +90,7 @@ def handle_location(location, target_dir, add_metrics=False, import_name=None):
         run_fun(cmd, check=True)
 
         if add_metrics:
-            cmd = [add_metrics_command]
+            cmd = [add_metrics_command, '--jobs', str(jobs)]
             dirs = list(sorted(map(str, filter(lambda x: x.is_dir(), local_target_dir.glob('*')))))
             cmd += dirs
             print("  - adding metrics to the following campaign directories:")
@@ -101,7 +101,7 @@ def handle_location(location, target_dir, add_metrics=False, import_name=None):
             if import_name is not None:
                 tag = import_name.format(name=name)
                 print(f"  - importing the campaigns under the tag '{tag}'")
-                cmd = [import_command, 'import_campaign']
+                cmd = [import_command, 'import_campaign', '--jobs', str(jobs)]
                 cmd.append(tag)
                 cmd += dirs
                 run_fun(cmd, check=True)
@@ -125,6 +125,9 @@ def main():
     argparser.add_argument('-i', '--import-name', metavar="TAG", default=None,
             help='import the downloaded campaigns with the specified tag to the ui. Requires -a. The tag can include a "{name}" place holder that is replaced with the corresponding name from the config. For example: "bughunt:{name}"')
 
+    argparser.add_argument('-j', '--jobs', metavar="N", type=int, default=1,
+        help='number of worker processes for adding metrics to and importing the downloaded campaigns')
+
     argparser.add_argument('-o', '--output', metavar="OUTFILE", default="./results",
         help='the directory to store the fetched runs')
 
@@ -148,7 +151,7 @@ def main():
     target_dir = Path(args.output)
 
     for location in locations:
-        handle_location(location, target_dir, add_metrics=args.add_metrics, import_name=args.import_name)
+        handle_location(location, target_dir, add_metrics=args.add_metrics, import_name=args.import_name, jobs=args.jobs)
 
     return 0
 
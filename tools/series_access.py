@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+""" Bulk retrieval of measurement series from AnICA's measurement database.
+
+`MeasurementDB.get_series` runs separate queries for the series, its
+measurements, and the predictor runs of each measurement. Here, the
+measurements and predictor runs of many series are fetched with a single
+joined query and grouped by series id.
+
+The queries depend on the table layout of the measurement database, which is
+defined in AnICA. Therefore, the result for one series (with predictor runs)
+is compared to that of `get_series` the first time a database is accessed.
+If they differ (or the queries fail), `get_series` is used for all series of
+that database.
+"""
+
+import argparse
+from datetime import datetime
+import os
+from pathlib import Path
+import sqlite3
+import time
+
+
+# maximal number of series ids per query, to stay below the limits of sqlite
+MAX_SERIES_PER_QUERY = 500
+
+# database file -> whether the bulk queries reproduce `get_series`
+_bulk_access_ok = dict()
+
+
+def _db_file(con):
+    for seq, name, filename in con.execute("PRAGMA database_list"):
+        if name == 'main':
+            return filename
+    return None
+
+
+def _fetch_series_chunk(con, series_ids, predictors, uarchs):
+    placeholders = ",".join("?" * len(series_ids))
+    res = dict()
+
+    query = f"SELECT series_id, source_computer, timestamp FROM series WHERE series_id IN ({placeholders})"
+    for series_id, source_computer, timestamp in con.execute(query, series_ids):
+        res[series_id] = {
+                "series_date": datetime.fromtimestamp(timestamp).isoformat(),
+                "source_computer": source_computer,
+                "measurements": [],
+            }
+
+    query = ("SELECT m.series_id, m.measurement_id, m.input, r.predictor_id, r.uarch_id, r.result, r.remark"
+            " FROM measurements m LEFT JOIN predictor_runs r ON r.measurement_id = m.measurement_id"
+            f" WHERE m.series_id IN ({placeholders})"
+            " ORDER BY m.series_id, m.measurement_id, r.predictor_run_id")
+    curr_measurement = None
+    for series_id, measurement_id, inp, predictor_id, uarch_id, result, remark in con.execute(query, series_ids):
+        if curr_measurement is None or curr_measurement["measurement_id"] != measurement_id:
+            curr_measurement = {
+                    "measurement_id": measurement_id,
+                    "input": inp,
+                    "predictor_runs": [],
+                }
+            res[series_id]["measurements"].append(curr_measurement)
+        if predictor_id is None:
+            # a measurement without predictor runs
+            continue
+        curr_measurement["predictor_runs"].append({
+                "predictor": predictors[predictor_id],
+                "uarch": uarchs[uarch_id],
+                "result": result,
+                "remark": remark,
+            })
+    return res
+
+
+def get_series_bulk(mdb, series_ids):
+    """ Get a dict from the given series ids to dicts in the format of
+    `MeasurementDB.get_series`, without checking that the formats agree. Ids
+    of series that do not exist are mapped to None.
+
+    The database connection of `mdb` needs to be open.
+    """
+    con = mdb.con
+    predictors = { predictor_id: (toolname, version) for predictor_id, toolname, version in con.execute("SELECT predictor_id, toolname, version FROM predictors") }
+    uarchs = { uarch_id: uarch_name for uarch_id, uarch_name in con.execute("SELECT uarch_id, uarch_name FROM uarchs") }
+
+    series_ids = list(dict.fromkeys(series_ids))
+    res = dict.fromkeys(series_ids)
+    for i in range(0, len(series_ids), MAX_SERIES_PER_QUERY):
+        res.update(_fetch_series_chunk(con, series_ids[i:i+MAX_SERIES_PER_QUERY], predictors, uarchs))
+    return res
+
+
+def _num_predictor_runs(series):
+    return sum(len(m["predictor_runs"]) for m in series["measurements"])
+
+
+def get_many_series(mdb, series_ids):
+    """ Get a dict from the given series ids to the results of
+    `mdb.get_series` for them, using the bulk queries if they reproduce
+    `get_series` for this database.
+
+    The database connection of `mdb` needs to be open.
+    """
+    series_ids = list(series_ids)
+    db_file = _db_file(mdb.con)
+    ok = _bulk_access_ok.get(db_file, None)
+
+    if ok is not False:
+        try:
+            res = get_series_bulk(mdb, series_ids)
+        except (sqlite3.Error, KeyError):
+            res = None
+            ok = False
+
+        if ok is None:
+            # compare the series with the most predictor runs
+            sample_id = max((series_id for series_id, series in res.items() if series is not None),
+                    key=lambda series_id: _num_predictor_runs(res[series_id]), default=None)
+            if sample_id is None:
+                # nothing to compare, do not trust the bulk result
+                res = None
+            elif res[sample_id] != mdb.get_series(sample_id):
+                ok = False
+            elif _num_predictor_runs(res[sample_id]) > 0:
+                ok = True
+
+        if ok is not None:
+            _bulk_access_ok[db_file] = ok
+            if not ok:
+                print(f"bulk access to measurement series differs from get_series for '{db_file}', falling back to per-series access")
+        if res is not None and ok is not False:
+            return res
+
+    return { series_id: mdb.get_series(series_id) for series_id in series_ids }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare the time for getting the measurement series of a campaign's discoveries one by one and in bulk.")
+    ap.add_argument('--batch-size', type=int, default=256, metavar="N", help="number of series to get with one bulk access")
+    ap.add_argument('campaigndir', metavar='DIR', help='path to a campaign result directory')
+    args = ap.parse_args()
+
+    from iwho.configurable import load_json_config
+    from add_metrics import _make_actx
+
+    discovery_dir = Path(args.campaigndir) / 'discoveries'
+    discovery_files = sorted(discovery_dir / fn for fn in os.listdir(discovery_dir))
+    if len(discovery_files) == 0:
+        print("no discoveries found")
+        return
+
+    actx = _make_actx(load_json_config(discovery_files[0])['config'])
+    series_ids = [ load_json_config(fn)['result_ref'] for fn in discovery_files ]
+
+    mdb = actx.measurement_db
+    mdb._init_con()
+    try:
+        start = time.perf_counter()
+        expected = { series_id: mdb.get_series(series_id) for series_id in series_ids }
+        single_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = dict()
+        for i in range(0, len(series_ids), args.batch_size):
+            actual.update(get_many_series(mdb, series_ids[i:i+args.batch_size]))
+        bulk_seconds = time.perf_counter() - start
+    finally:
+        mdb._deinit_con()
+
+    print(f"{len(series_ids)} series: {single_seconds:.2f}s with get_series, {bulk_seconds:.2f}s in batches of {args.batch_size}"
+          f" ({single_seconds / max(bulk_seconds, 1e-9):.1f}x), results {'identical' if actual == expected else 'DIFFERENT'}")
+
+
+if __name__ == "__main__":
+    main()